@@ -341,8 +341,8 @@ class TunnelRiskGraph:
     def __init__(self):
         self.graph = build_graph()
     
-    def run(self, risk_type: str, sensor_data: dict = None, location: str = "") -> dict:
-        """运行智能体"""
+    def run(self, risk_type: str, sensor_data: dict = None, location: str = "", on_step=None) -> dict:
+        """运行智能体；传入 on_step(node, state) 时逐节点回调进度"""
         initial_state: AgentState = {
             "risk_type": risk_type,
             "sensor_data": sensor_data or {},
@@ -356,14 +356,23 @@ class TunnelRiskGraph:
             "messages": []
         }
         
-        result = self.graph.invoke(initial_state)
+        if on_step is None:
+            return self.graph.invoke(initial_state)
+
+        # 各节点都返回完整状态，按节点流式执行并合并即可得到与 invoke 相同的结果
+        result = dict(initial_state)
+        for chunk in self.graph.stream(initial_state, stream_mode="updates"):
+            for node, update in chunk.items():
+                result.update(update or {})
+                on_step(node, result)
         return result
 
 
-def run_agent(risk_type: str, sensor_data: dict = None, location: str = "", auto_triggered: bool = False) -> dict:
+def run_agent(risk_type: str, sensor_data: dict = None, location: str = "", auto_triggered: bool = False,
+              on_step=None) -> dict:
     """便捷函数：运行智能体并保存记忆"""
     agent = TunnelRiskGraph()
-    result = agent.run(risk_type, sensor_data, location)
+    result = agent.run(risk_type, sensor_data, location, on_step=on_step)
     
     # 保存到记忆库
     memory = get_memory()
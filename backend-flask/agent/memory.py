@@ -5,7 +5,6 @@
 基于 Supabase 实现
 """
 
-import os
 import json
 from datetime import datetime
 from typing import List, Dict, Optional, Any
@@ -28,11 +27,10 @@ class AgentMemory:
     def _init_client(self):
         """初始化 Supabase 客户端"""
         try:
-            from supabase_client import SupabaseClient
-            url = os.getenv("SUPABASE_URL", "")
-            key = os.getenv("SUPABASE_SERVICE_KEY", "")
-            if url and key:
-                self._client = SupabaseClient(url, key)
+            from supabase_client import get_client
+            client = get_client()
+            if client.configured:
+                self._client = client
                 print("[AgentMemory] Supabase 连接已建立")
             else:
                 print("[AgentMemory] 警告: Supabase 未配置，记忆功能将降级为内存模式")
@@ -207,64 +205,18 @@ class AgentMemory:
     
     def _insert_record(self, table: str, record: Dict) -> Optional[Dict]:
         """插入记录到 Supabase"""
-        import requests
-        
-        url = os.getenv("SUPABASE_URL", "").rstrip("/")
-        key = os.getenv("SUPABASE_SERVICE_KEY", "")
-        
-        if not url or not key:
+        if not self._client:
             return None
-        
-        headers = {
-            "apikey": key,
-            "Authorization": f"Bearer {key}",
-            "Content-Type": "application/json",
-            "Prefer": "return=representation"
-        }
-        
-        try:
-            r = requests.post(
-                f"{url}/rest/v1/{table}",
-                headers=headers,
-                json=record,
-                timeout=5
-            )
-            if r.status_code in (200, 201):
-                data = r.json()
-                return data[0] if isinstance(data, list) and data else data
-        except Exception as e:
-            print(f"[AgentMemory] Insert error: {e}")
-        
+        rows = self._client.insert(table, record)
+        if rows:
+            return rows[0]
         return None
     
     def _update_record(self, table: str, record_id: str, updates: Dict) -> bool:
         """更新 Supabase 记录"""
-        import requests
-        
-        url = os.getenv("SUPABASE_URL", "").rstrip("/")
-        key = os.getenv("SUPABASE_SERVICE_KEY", "")
-        
-        if not url or not key:
+        if not self._client:
             return False
-        
-        headers = {
-            "apikey": key,
-            "Authorization": f"Bearer {key}",
-            "Content-Type": "application/json"
-        }
-        
-        try:
-            r = requests.patch(
-                f"{url}/rest/v1/{table}?id=eq.{record_id}",
-                headers=headers,
-                json=updates,
-                timeout=5
-            )
-            return r.status_code in (200, 204)
-        except Exception as e:
-            print(f"[AgentMemory] Update error: {e}")
-        
-        return False
+        return self._client.update(table, {"id": f"eq.{record_id}"}, updates)
     
     def get_memory_summary(self) -> Dict:
         """获取记忆库摘要信息"""
@@ -275,7 +227,7 @@ class AgentMemory:
         
         if self._client:
             try:
-                count = self._client.count("agent_episodes")
+                count = self._client.count("agent_episodes", ttl=30, mode="estimated")
                 summary["total_episodes"] = count
             except:
                 pass
@@ -5,7 +5,6 @@
 支持从 Supabase 获取真实数据，无连接时降级为模拟数据
 """
 
-import os
 import json
 from datetime import datetime
 from typing import Optional
@@ -15,28 +14,29 @@ from langchain_core.tools import tool
 # ================= 数据源适配器 =================
 
 def _get_supabase_client():
-    """获取 Supabase 客户端实例（懒加载）"""
+    """获取进程级共享的 Supabase 客户端（复用连接池与缓存）"""
     try:
-        from supabase_client import SupabaseClient
-        url = os.getenv("SUPABASE_URL", "")
-        key = os.getenv("SUPABASE_SERVICE_KEY", "")
-        if url and key:
-            return SupabaseClient(url, key)
+        from supabase_client import get_client
+        client = get_client()
+        if client.configured:
+            return client
     except ImportError:
         pass
     return None
 
 
-def _fetch_from_supabase(table: str, limit: int = 1):
-    """从 Supabase 获取数据，失败返回 None"""
+def _fetch_from_supabase(spec_name: str):
+    """按 queries 中的查询规格（列投影下推）从 Supabase 获取数据，失败返回 None"""
     client = _get_supabase_client()
     if not client:
         return None
     try:
-        data = client.get_list(table, limit=limit)
+        import queries
+        spec = getattr(queries, spec_name)
+        data = queries.run(client, spec, ttl=2)
         return data if data else None
     except Exception as e:
-        print(f"[Tools] Supabase fetch error for {table}: {e}")
+        print(f"[Tools] Supabase fetch error for {spec_name}: {e}")
         return None
 
 
@@ -58,10 +58,10 @@ def query_sensors(sensor_type: str = "all") -> str:
     
     # ===== 瓦斯/气体数据 =====
     if sensor_type in ("all", "gas"):
-        gas_data = _fetch_from_supabase("gas_concentration", limit=1)
+        gas_data = _fetch_from_supabase("SENSOR_GAS")
         if gas_data and len(gas_data) > 0:
             row = gas_data[0]
-            ch4_val = row.get("value", row.get("ch4", 0.08))
+            ch4_val = row.get("value") if row.get("value") is not None else 0.08
             sensors["gas"] = {
                 "ch4": ch4_val,
                 "co": row.get("co", 0.002),
@@ -85,12 +85,12 @@ def query_sensors(sensor_type: str = "all") -> str:
     
     # ===== 泥浆/土压数据 =====
     if sensor_type in ("all", "pressure"):
-        pressure_data = _fetch_from_supabase("slurry_pressure", limit=1)
+        pressure_data = _fetch_from_supabase("SENSOR_PRESSURE")
         if pressure_data and len(pressure_data) > 0:
             row = pressure_data[0]
             sensors["pressure"] = {
                 "soil_chamber": row.get("soil_chamber", 2.45),
-                "slurry": row.get("value", row.get("slurry", 1.82)),
+                "slurry": row.get("value") if row.get("value") is not None else 1.82,
                 "unit": "bar",
                 "status": "normal",
                 "timestamp": row.get("ts", now_iso),
@@ -109,7 +109,7 @@ def query_sensors(sensor_type: str = "all") -> str:
     # ===== 温度数据 =====
     if sensor_type in ("all", "temperature"):
         # 温度表（如果存在）
-        temp_data = _fetch_from_supabase("temperature", limit=1)
+        temp_data = _fetch_from_supabase("SENSOR_TEMPERATURE")
         if temp_data and len(temp_data) > 0:
             row = temp_data[0]
             sensors["temperature"] = {
@@ -261,7 +261,7 @@ def query_personnel(zone: str = "all") -> str:
         人员信息
     """
     # 尝试从 Supabase 获取人员数据
-    stats_data = _fetch_from_supabase("stats", limit=1)
+    stats_data = _fetch_from_supabase("PERSONNEL_STATS_RAW")
     
     if stats_data and len(stats_data) > 0:
         row = stats_data[0]
@@ -0,0 +1,301 @@
+import os
+import time
+import uuid
+import heapq
+import threading
+from collections import OrderedDict
+
+import metrics
+
+# 智能体后台任务队列：自动监控与接口触发的分析都在独立的工作线程中运行，不占用调度器或 HTTP 线程
+# - 优先级：按风险类型（AGENT_PRIORITIES，数值越小越优先），同优先级先进先出
+# - 去重：同一 (风险类型, 位置) 已在排队/运行中，或在 AGENT_DEDUP_WINDOW 秒内已完成时，直接返回已有任务；
+#   接口主动提交（dedup=False）不套用该窗口，只合并传感器数据完全相同、仍在排队/运行中的任务
+# - 限深：排队数达到 AGENT_QUEUE_MAX 时，新任务优先级更高则挤掉队尾最低优先级的任务，否则拒绝
+# - 状态变化（queued / running / completed / failed / dropped）与运行中的逐节点进度广播到 agent-status 主题
+# - 多 worker：各进程从经 broker 送达的 agent-status 消息维护其他 worker 任务的状态副本（同样限 AGENT_JOB_HISTORY 条），
+#   任一 worker 都能回答任务查询；副本中的结果只含广播的字段
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+DROPPED = "dropped"
+
+DEFAULT_PRIORITIES = "gas:0,settlement:1,pressure:1,personnel:1,vehicle:2,advance:2"
+# 工作流节点的中文名，用于逐节点进度消息
+NODE_LABELS = {"perceive": "感知", "analyze": "分析", "retrieve": "检索", "plan": "规划", "execute": "执行", "report": "报告"}
+
+_job_events = metrics.counter("agent_jobs_total", "智能体任务状态变化次数", ("state",))
+_job_duration = metrics.histogram("agent_job_duration_seconds", "智能体任务运行耗时", ("risk_type",),
+                                  buckets=(1, 2.5, 5, 10, 20, 30, 60, 120, 300))
+
+
+def _parse_priorities(value):
+    out = {}
+    for part in (value or "").split(","):
+        name, _, prio = part.partition(":")
+        if name.strip() and prio.strip():
+            try:
+                out[name.strip()] = int(prio)
+            except ValueError:
+                pass
+    return out
+
+
+class AgentJob:
+    def __init__(self, risk_type: str, sensor_data: dict, location: str, priority: int, auto_triggered: bool):
+        self.id = uuid.uuid4().hex[:12]
+        self.risk_type = risk_type
+        self.sensor_data = sensor_data or {}
+        self.location = location or ""
+        self.priority = priority
+        self.auto_triggered = auto_triggered
+        self.state = QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.progress = []
+
+    @property
+    def key(self):
+        return (self.risk_type, self.location)
+
+    def to_dict(self, with_result: bool = True):
+        out = {
+            "job_id": self.id,
+            "state": self.state,
+            "risk_type": self.risk_type,
+            "location": self.location,
+            "priority": self.priority,
+            "auto_triggered": self.auto_triggered,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": list(self.progress),
+        }
+        if self.error:
+            out["error"] = self.error
+        if with_result and self.result is not None:
+            out["result"] = self.result
+        return out
+
+
+class AgentJobQueue:
+    def __init__(self, hub, runner=None, workers: int = None, max_depth: int = None,
+                 dedup_window: float = None, history: int = None):
+        self.hub = hub
+        self.runner = runner
+        self.workers = workers or int(os.getenv("AGENT_WORKERS", "2"))
+        self.max_depth = max_depth or int(os.getenv("AGENT_QUEUE_MAX", "20"))
+        self.dedup_window = float(os.getenv("AGENT_DEDUP_WINDOW", "300")) if dedup_window is None else dedup_window
+        self.history = history or int(os.getenv("AGENT_JOB_HISTORY", "200"))
+        self.priorities = _parse_priorities(os.getenv("AGENT_PRIORITIES", DEFAULT_PRIORITIES))
+        self.default_priority = max(self.priorities.values(), default=0) + 1
+        self._heap = []
+        self._seq = 0
+        self._jobs = OrderedDict()
+        self._remote = OrderedDict()
+        self._active = {}
+        self._cond = threading.Condition()
+        self._threads = []
+        self.deduplicated = 0
+        self.rejected = 0
+        self.dropped = 0
+        if hasattr(hub, "add_delivery_listener"):
+            hub.add_delivery_listener("agent-status", self._on_status)
+
+    def priority_of(self, risk_type: str) -> int:
+        return self.priorities.get(risk_type, self.default_priority)
+
+    def submit(self, risk_type: str, sensor_data: dict = None, location: str = "", auto_triggered: bool = False,
+               dedup: bool = True):
+        """提交任务，返回 (job, status)：status 为 queued / duplicate / rejected（rejected 时 job 为 None）。"""
+        job = AgentJob(risk_type, sensor_data, location, self.priority_of(risk_type), auto_triggered)
+        evicted = None
+        with self._cond:
+            existing = self._find_duplicate(job.key) if dedup else self._find_inflight(job)
+            if existing is not None:
+                self.deduplicated += 1
+                return existing, "duplicate"
+            queued = [entry for entry in self._heap if entry[2].state == QUEUED]
+            if len(queued) >= self.max_depth:
+                lowest = max(queued, key=lambda e: (e[0], e[1]))
+                if lowest[0] <= job.priority:
+                    self.rejected += 1
+                    return None, "rejected"
+                evicted = lowest[2]
+                evicted.state = DROPPED
+                evicted.finished_at = time.time()
+                if self._active.get(evicted.key) is evicted:
+                    del self._active[evicted.key]
+                self.dropped += 1
+            self._seq += 1
+            heapq.heappush(self._heap, (job.priority, self._seq, job))
+            self._remember(job)
+            self._active[job.key] = job
+            self._ensure_workers()
+            self._cond.notify()
+        if evicted is not None:
+            self._emit(evicted, message=f"队列已满，{evicted.location} 的 {evicted.risk_type} 任务被更高优先级任务替换")
+        self._emit(job, message=f"{job.location or '现场'} {job.risk_type} 风险已进入分析队列")
+        return job, "queued"
+
+    def _find_duplicate(self, key):
+        job = self._active.get(key)
+        if job is not None and job.state in (QUEUED, RUNNING):
+            return job
+        if job is not None and job.state == COMPLETED and time.time() - (job.finished_at or 0) < self.dedup_window:
+            return job
+        return None
+
+    def _find_inflight(self, job):
+        existing = self._active.get(job.key)
+        if existing is not None and existing.state in (QUEUED, RUNNING) and existing.sensor_data == job.sensor_data:
+            return existing
+        return None
+
+    def _remember(self, job):
+        self._jobs[job.id] = job
+        while len(self._jobs) > self.history:
+            self._jobs.popitem(last=False)
+
+    def get(self, job_id: str):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def lookup(self, job_id: str):
+        """任务状态字典：本进程的任务返回完整记录，其他 worker 的任务返回由广播消息重建的副本。"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job.to_dict()
+            record = self._remote.get(job_id)
+            return dict(record, progress=list(record["progress"])) if record is not None else None
+
+    def _on_status(self, channel, payload):
+        job_id = payload.get("job_id") if isinstance(payload, dict) else None
+        if not job_id:
+            return
+        with self._cond:
+            if job_id in self._jobs:
+                return
+            record = self._remote.get(job_id)
+            if record is None:
+                record = self._remote[job_id] = {"job_id": job_id, "progress": []}
+                while len(self._remote) > self.history:
+                    self._remote.popitem(last=False)
+            for k in ("state", "risk_type", "location", "priority", "auto_triggered",
+                      "created_at", "started_at", "finished_at", "error"):
+                if payload.get(k) is not None:
+                    record[k] = payload[k]
+            if payload.get("node"):
+                record["progress"].append({"node": payload["node"], "at": payload.get("at")})
+            if payload.get("result") is not None:
+                record["result"] = {**payload["result"], "risk_level": payload.get("risk_level")}
+
+    def _ensure_workers(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._work, name=f"agent-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _next(self):
+        with self._cond:
+            while True:
+                while self._heap:
+                    _, _, job = heapq.heappop(self._heap)
+                    if job.state == QUEUED:
+                        job.state = RUNNING
+                        job.started_at = time.time()
+                        return job
+                self._cond.wait()
+
+    def _work(self):
+        while True:
+            job = self._next()
+            where = job.location or "现场"
+            self._emit(job, message=f"监测到 {where} 异常数据，智能体介入分析中..." if job.auto_triggered
+                       else f"智能体正在分析 {where} 的 {job.risk_type} 风险...")
+            try:
+                result = self._run(job)
+                job.result = {
+                    "risk_level": result.get("risk_level"),
+                    "analysis": result.get("analysis_result"),
+                    "decision_plan": result.get("decision_plan", []),
+                    "retrieved_docs": result.get("retrieved_docs", []),
+                    "reasoning_steps": result.get("reasoning_steps", []),
+                    "report": result.get("report", ""),
+                    "episode_id": result.get("episode_id"),
+                }
+                job.state = COMPLETED
+            except Exception as e:
+                print(f"[AgentJobs] ❌ 任务 {job.id} 失败: {e}")
+                job.error = str(e)
+                job.state = FAILED
+            job.finished_at = time.time()
+            _job_duration.observe(job.finished_at - job.started_at, risk_type=job.risk_type)
+            if job.state == FAILED:
+                with self._cond:
+                    # 失败的任务不参与去重窗口，允许立即重试
+                    if self._active.get(job.key) is job:
+                        del self._active[job.key]
+            self._emit(job)
+
+    def _run(self, job):
+        def on_step(node, state):
+            job.progress.append({"node": node, "at": time.time()})
+            self._emit(job, message=f"智能体已完成{NODE_LABELS.get(node, node)}步骤", node=node,
+                       risk_level=state.get("risk_level") or None)
+
+        if self.runner is not None:
+            return self.runner(job, on_step)
+        from agent import run_agent
+        return run_agent(job.risk_type, job.sensor_data, job.location, auto_triggered=job.auto_triggered,
+                         on_step=on_step)
+
+    def _emit(self, job, message: str = None, node: str = None, risk_level: str = None):
+        if node is None:
+            _job_events.inc(state=job.state)
+        payload = {
+            "state": job.state,
+            "job_id": job.id,
+            "risk_type": job.risk_type,
+            "location": job.location,
+            "auto_triggered": job.auto_triggered,
+            "priority": job.priority,
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+        }
+        if message:
+            payload["message"] = message
+        if node:
+            payload["node"] = node
+            payload["step"] = len(job.progress)
+            payload["at"] = job.progress[-1]["at"]
+            if risk_level:
+                payload["risk_level"] = risk_level
+        if job.state == COMPLETED and job.result:
+            payload["risk_level"] = job.result.get("risk_level")
+            payload["plan_count"] = len(job.result.get("decision_plan") or [])
+            payload["result"] = {k: job.result.get(k) for k in ("analysis", "decision_plan", "report", "episode_id")}
+        if job.error:
+            payload["error"] = job.error
+        try:
+            self.hub.broadcast("agent-status", "agent", payload)
+        except Exception as e:
+            print("[AgentJobs] broadcast failed:", e)
+
+    def stats(self):
+        with self._cond:
+            queued = sum(1 for e in self._heap if e[2].state == QUEUED)
+            running = sum(1 for j in self._jobs.values() if j.state == RUNNING)
+            recent = [j.to_dict(with_result=False) for j in reversed(self._jobs.values())][:20]
+        return {"queued": queued, "running": running, "workers": self.workers, "maxDepth": self.max_depth,
+                "deduplicated": self.deduplicated, "rejected": self.rejected, "dropped": self.dropped,
+                "recent": recent}
@@ -0,0 +1,209 @@
+import os
+import math
+import threading
+from collections import deque
+
+import metrics
+
+try:
+    import numpy as np
+except ImportError:  # 没有 NumPy 时回填退回逐点更新
+    np = None
+
+# 流式异常检测：每条时序流维护滑动窗口均值/方差、EWMA 与双侧 CUSUM，每个新点 O(1) 更新
+# 新点先用更新前的统计量打分，再并入窗口；规则：
+# - zscore：|x - 均值| / 标准差 超过 ANOMALY_Z
+# - ewma：EWMA 偏离窗口均值超过 ANOMALY_EWMA_L 倍控制限（标准 EWMA 控制图）
+# - cusum_up / cusum_down：标准化残差的累积和超过 ANOMALY_CUSUM_H（漂移量 ANOMALY_CUSUM_K），报警后清零
+# - limit：超过 ANOMALY_LIMITS 配置的绝对上限（默认不启用，如 ANOMALY_LIMITS=gas_concentration:16）
+# 首次加载的历史数据用 NumPy 向量化回填（不打分），窗口未满 ANOMALY_MIN_POINTS 个点前不报警
+
+# 时序表 -> 智能体风险类型与默认位置
+STREAMS = {
+    "gas_concentration": {"risk_type": "gas", "location": "回风管路 A1段", "label": "瓦斯浓度"},
+    "slurry_pressure": {"risk_type": "pressure", "location": "盾构机泥水仓", "label": "泥水压力"},
+    "settlement_actual": {"risk_type": "settlement", "location": "地表沉降监测断面", "label": "地表沉降"},
+    "advance_speed": {"risk_type": "advance", "location": "盾构掘进面", "label": "掘进速度"},
+}
+
+_alerts = metrics.counter("anomaly_alerts_total", "异常检测触发次数", ("stream", "rule"))
+
+
+def _parse_limits(value):
+    out = {}
+    for part in (value or "").split(","):
+        name, _, limit = part.partition(":")
+        try:
+            out[name.strip()] = float(limit)
+        except ValueError:
+            pass
+    return out
+
+
+class StreamDetector:
+    def __init__(self, name: str, window: int, alpha: float, z_limit: float, ewma_l: float,
+                 cusum_k: float, cusum_h: float, min_points: int, upper: float = None):
+        self.name = name
+        self.window = window
+        self.alpha = alpha
+        self.z_limit = z_limit
+        self.ewma_l = ewma_l
+        self.cusum_k = cusum_k
+        self.cusum_h = cusum_h
+        self.min_points = min_points
+        self.upper = upper
+        self._win = deque(maxlen=window)
+        self._sum = 0.0
+        self._sumsq = 0.0
+        self.ewma = None
+        self.cusum_pos = 0.0
+        self.cusum_neg = 0.0
+        self.count = 0
+        self.last = None
+
+    @property
+    def mean(self):
+        n = len(self._win)
+        return self._sum / n if n else None
+
+    @property
+    def std(self):
+        n = len(self._win)
+        if n < 2:
+            return None
+        var = max(0.0, (self._sumsq - self._sum * self._sum / n) / (n - 1))
+        # 近似常量的序列给一个相对下限，避免微小波动被放大成异常
+        return max(math.sqrt(var), 0.01 * abs(self._sum / n), 1e-9)
+
+    def _push(self, x: float):
+        if len(self._win) == self.window:
+            old = self._win[0]
+            self._sum -= old
+            self._sumsq -= old * old
+        self._win.append(x)
+        self._sum += x
+        self._sumsq += x * x
+        self.ewma = x if self.ewma is None else self.alpha * x + (1 - self.alpha) * self.ewma
+        self.count += 1
+        self.last = x
+
+    def backfill(self, values):
+        """用历史值初始化统计量，不打分。"""
+        if not values:
+            return
+        if np is None:
+            for x in values:
+                self._push(float(x))
+            return
+        arr = np.asarray(values, dtype=float)
+        n = len(arr)
+        a = self.alpha
+        # EWMA 闭式解：e_n = (1-a)^n * e_0 + Σ a(1-a)^(n-1-i) x_i；没有初值时以首点为初值
+        weights = a * (1 - a) ** np.arange(n - 1, -1, -1)
+        if self.ewma is None:
+            weights[0] = (1 - a) ** (n - 1)
+            self.ewma = float(weights @ arr)
+        else:
+            self.ewma = float((1 - a) ** n * self.ewma + weights @ arr)
+        self._win.extend(arr[-self.window:].tolist())
+        win = np.fromiter(self._win, dtype=float, count=len(self._win))
+        self._sum = float(win.sum())
+        self._sumsq = float(win @ win)
+        self.cusum_pos = self.cusum_neg = 0.0
+        self.count += n
+        self.last = float(arr[-1])
+
+    def update(self, x: float):
+        """并入一个新点，返回触发的规则列表与打分明细。"""
+        x = float(x)
+        rules = []
+        detail = {"value": x}
+        if self.upper is not None and x > self.upper:
+            rules.append("limit")
+        mean, std = self.mean, self.std
+        if len(self._win) >= self.min_points and std is not None:
+            z = (x - mean) / std
+            if abs(z) >= self.z_limit:
+                rules.append("zscore")
+            self.cusum_pos = max(0.0, self.cusum_pos + z - self.cusum_k)
+            self.cusum_neg = max(0.0, self.cusum_neg - z - self.cusum_k)
+            if self.cusum_pos > self.cusum_h:
+                rules.append("cusum_up")
+            if self.cusum_neg > self.cusum_h:
+                rules.append("cusum_down")
+            if "cusum_up" in rules or "cusum_down" in rules:
+                detail["cusum"] = round(max(self.cusum_pos, self.cusum_neg), 3)
+                self.cusum_pos = self.cusum_neg = 0.0
+            ewma = self.alpha * x + (1 - self.alpha) * self.ewma
+            if abs(ewma - mean) > self.ewma_l * std * math.sqrt(self.alpha / (2 - self.alpha)):
+                rules.append("ewma")
+            detail.update({"mean": round(mean, 4), "std": round(std, 4), "z": round(z, 3)})
+        self._push(x)
+        detail["ewma"] = round(self.ewma, 4)
+        return rules, detail
+
+    def stats(self):
+        mean, std = self.mean, self.std
+        return {"count": self.count, "window": len(self._win), "last": self.last,
+                "mean": round(mean, 4) if mean is not None else None,
+                "std": round(std, 4) if std is not None else None,
+                "ewma": round(self.ewma, 4) if self.ewma is not None else None,
+                "cusumPos": round(self.cusum_pos, 3), "cusumNeg": round(self.cusum_neg, 3)}
+
+
+class AnomalyDetector:
+    """按时序表名管理 StreamDetector；feed 传入按 ts 升序的行，只处理上次之后的新行。"""
+
+    def __init__(self, streams=None):
+        self.streams = streams or STREAMS
+        window = int(os.getenv("ANOMALY_WINDOW", "60"))
+        limits = _parse_limits(os.getenv("ANOMALY_LIMITS", ""))
+        self._detectors = {
+            name: StreamDetector(
+                name, window,
+                alpha=float(os.getenv("ANOMALY_EWMA_ALPHA", "0.2")),
+                z_limit=float(os.getenv("ANOMALY_Z", "4")),
+                ewma_l=float(os.getenv("ANOMALY_EWMA_L", "3.5")),
+                cusum_k=float(os.getenv("ANOMALY_CUSUM_K", "0.5")),
+                cusum_h=float(os.getenv("ANOMALY_CUSUM_H", "8")),
+                min_points=min(window, int(os.getenv("ANOMALY_MIN_POINTS", "20"))),
+                upper=limits.get(name),
+            )
+            for name in self.streams
+        }
+        self._cursor = {}
+        self._lock = threading.Lock()
+        self.alerts = 0
+
+    def feed(self, name: str, rows):
+        """返回本批新行触发的告警列表（每个触发点一条）。"""
+        det = self._detectors[name]
+        with self._lock:
+            cursor = self._cursor.get(name)
+            # 缓冲区按 ts 升序，从尾部往前找游标之后的新行
+            start = len(rows)
+            while start > 0 and (cursor is None or str(rows[start - 1].get("ts")) > cursor):
+                start -= 1
+            fresh = [r for r in rows[start:] if r.get("value") is not None]
+            if not fresh:
+                return []
+            self._cursor[name] = str(fresh[-1].get("ts"))
+            # 首次加载或落后超过一个窗口：历史部分批量回填，只对最新一点打分
+            if cursor is None or len(fresh) > det.window:
+                det.backfill([r["value"] for r in fresh[:-1]])
+                fresh = fresh[-1:]
+            alerts = []
+            for row in fresh:
+                rules, detail = det.update(row["value"])
+                if rules:
+                    for rule in rules:
+                        _alerts.inc(stream=name, rule=rule)
+                    self.alerts += 1
+                    alerts.append({"stream": name, "ts": row.get("ts"), "rules": rules, **detail})
+            return alerts
+
+    def stats(self):
+        with self._lock:
+            return {"alerts": self.alerts, "numpy": np is not None,
+                    "streams": {name: {**d.stats(), "cursor": self._cursor.get(name)}
+                                for name, d in self._detectors.items()}}
@@ -6,20 +6,34 @@ from openai import OpenAI
 from datetime import datetime, timezone
 from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
-from supabase_client import SupabaseClient
-from sse import SseHub
+from supabase_client import get_client
+from sse import SseHub, parse_list
+from broker import create_broker
+from timeseries_sync import TimeSeriesSync
+from snapshot import LatestSnapshot
+from agent_jobs import AgentJobQueue
+import metrics
+import queries
 
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY", "")
-supa = SupabaseClient(SUPABASE_URL, SUPABASE_SERVICE_KEY)
-sse_hub = SseHub()
+supa = get_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+sse_hub = SseHub(broker=create_broker())
+ts_sync = TimeSeriesSync(supa, select="ts,value")
+# 轮询计划写入的最新值快照；仅运行调度器的进程有数据，其余情况回退到直接查询
+latest_snapshot = LatestSnapshot()
+# 智能体分析任务队列：工作线程按需启动，状态经 agent-status 主题广播
+agent_jobs = AgentJobQueue(sse_hub)
 USE_SUPABASE = bool(SUPABASE_URL and SUPABASE_SERVICE_KEY and os.getenv("USE_SUPABASE", "0") == "1")
+# 看板接口启用 stale-while-revalidate：缓存年龄在 stale 窗口内时直接返回旧值并后台刷新
+STALE_TTL = float(os.getenv("DASHBOARD_STALE_TTL", "120"))
 if os.getenv("DISABLE_SCHEDULER", "0") != "1":
     from scheduler import start_scheduler
-    start_scheduler(supa, sse_hub)
+    # 多 worker 部署时只有 broker 选出的 leader 运行轮询任务，广播经 broker 送达所有 worker
+    sse_hub.broker.on_leader(lambda: start_scheduler(supa, sse_hub, latest_snapshot, agent_jobs, ts_sync))
 video_store = []
 
 def fmt_time_str(iso):
@@ -29,26 +43,16 @@ def fmt_time_str(iso):
     except Exception:
         return iso
 
-def fmt_ts_value(rows):
-    return [{"ts": r.get("ts"), "value": r.get("value")} for r in rows]
-
 @app.get("/api/dashboard/summary")
 def dashboard_summary():
-    latest = supa.get_list("summary", limit=1, ttl=10)
+    row = latest_snapshot.get("summary", max_age=10) or queries.first(supa, queries.DASHBOARD_SUMMARY, ttl=10, stale_ttl=STALE_TTL)
     base = {
         "projectName": "隧道监测项目",
         "lat": 31.2304,
         "lng": 121.4737
     }
-    if latest:
-        row = latest[0]
-        base["cameraOnline"] = row.get("camera_online", 0)
-        base["cameraTotal"] = row.get("camera_total", 0)
-        base["ringToday"] = row.get("ring_today", 0)
-        base["ringCumulative"] = row.get("ring_cumulative", 0)
-        base["muckToday"] = row.get("muck_today", 0)
-        base["slurryPressureAvg"] = row.get("slurry_pressure_avg", 0)
-        base["gasAlerts"] = row.get("gas_alerts", 0)
+    if row:
+        base.update(row)
     else:
         base.update({
             "cameraOnline": 12, "cameraTotal": 16, "ringToday": 4,
@@ -59,8 +63,8 @@ def dashboard_summary():
 
 @app.get("/api/dashboard/notifications")
 def dashboard_notifications():
-    rows = supa.get_list("notifications", order="ts.desc", limit=30, ttl=8) if USE_SUPABASE else []
-    result = [{"time": fmt_time_str(r.get("ts", "")), "type": r.get("type", ""), "content": r.get("content", "")} for r in rows]
+    rows = queries.run(supa, queries.DASHBOARD_NOTIFICATIONS, ttl=8, stale_ttl=STALE_TTL) if USE_SUPABASE else []
+    result = [{**r, "time": fmt_time_str(r.get("time") or "")} for r in rows]
     if not result:
         now = datetime.now().strftime("%H:%M:%S")
         result = [
@@ -72,7 +76,7 @@ def dashboard_notifications():
 
 @app.get("/api/dashboard/supplies")
 def dashboard_supplies():
-    rows = supa.get_list("supplies", order="category.asc", limit=100, ttl=15) if USE_SUPABASE else []
+    rows = queries.run(supa, queries.DASHBOARD_SUPPLIES, ttl=15, stale_ttl=STALE_TTL) if USE_SUPABASE else []
     result = {}
     for r in rows:
         k = r.get("category")
@@ -85,8 +89,8 @@ def dashboard_supplies():
 
 @app.get("/api/dashboard/dispatch")
 def dashboard_dispatch():
-    rows = supa.get_list("dispatch", order="ts.desc", limit=50, ttl=8) if USE_SUPABASE else []
-    result = [{"time": fmt_time_str(r.get("ts", "")), "type": r.get("type", ""), "unit": r.get("unit", ""), "status": r.get("status", "")} for r in rows]
+    rows = queries.run(supa, queries.DASHBOARD_DISPATCH, ttl=8, stale_ttl=STALE_TTL) if USE_SUPABASE else []
+    result = [{**r, "time": fmt_time_str(r.get("time") or "")} for r in rows]
     if not result:
         now = datetime.now().strftime("%H:%M:%S")
         result = [
@@ -98,9 +102,7 @@ def dashboard_dispatch():
 @app.get("/api/dashboard/timeseries")
 def dashboard_timeseries():
     if USE_SUPABASE:
-        advance = fmt_ts_value(supa.get_list("advance_speed", order="ts.asc", limit=300, ttl=10))
-        slurry = fmt_ts_value(supa.get_list("slurry_pressure", order="ts.asc", limit=300, ttl=10))
-        gas = fmt_ts_value(supa.get_list("gas_concentration", order="ts.asc", limit=300, ttl=10))
+        advance, slurry, gas = ts_sync.series_many(["advance_speed", "slurry_pressure", "gas_concentration"], ttl=10)
     else:
         advance, slurry, gas = [], [], []
     if not advance:
@@ -116,15 +118,9 @@ def dashboard_timeseries():
 
 @app.get("/api/personnel/stats")
 def personnel_stats():
-    latest = supa.get_list("stats", limit=1, ttl=10)
-    if latest:
-        r = latest[0]
-        return jsonify({
-            "totalOnSite": r.get("total_on_site", 0),
-            "attendanceRate": r.get("attendance_rate", "0%"),
-            "violations": r.get("violations", 0),
-            "managers": r.get("managers", 0)
-        })
+    row = latest_snapshot.get("personnel_stats", max_age=10) or queries.first(supa, queries.PERSONNEL_STATS, ttl=10, stale_ttl=STALE_TTL)
+    if row:
+        return jsonify(row)
     return jsonify({"totalOnSite": 0, "attendanceRate": "0%", "violations": 0, "managers": 0})
 
 @app.get("/api/personnel/distribution")
@@ -145,8 +141,7 @@ def personnel_list():
 
 @app.get("/api/personnel/attendanceTrend")
 def personnel_attendance_trend():
-    rows = supa.get_list("attendance_trend", order="ts.asc", limit=300, ttl=10) if USE_SUPABASE else []
-    series = fmt_ts_value(rows)
+    series = ts_sync.series("attendance_trend", ttl=10) if USE_SUPABASE else []
     if not series:
         base = datetime.now(timezone.utc)
         series = [{"ts": (base.replace(microsecond=0).isoformat()), "value": 80 + (i % 10)} for i in range(60)]
@@ -154,16 +149,9 @@ def personnel_attendance_trend():
 
 @app.get("/api/progress/stats")
 def progress_stats():
-    latest = supa.get_list("stats_progress", limit=1, ttl=10)
-    if latest:
-        r = latest[0]
-        return jsonify({
-            "totalRings": r.get("total_rings", 0),
-            "totalGoal": r.get("total_goal", 0),
-            "dailyRings": r.get("daily_rings", 0),
-            "remainingDays": r.get("remaining_days", 0),
-            "value": r.get("value", 0)
-        })
+    row = latest_snapshot.get("progress_stats", max_age=10) or queries.first(supa, queries.PROGRESS_STATS, ttl=10, stale_ttl=STALE_TTL)
+    if row:
+        return jsonify(row)
     return jsonify({"totalRings": 0, "totalGoal": 0, "dailyRings": 0, "remainingDays": 0, "value": 0})
 
 @app.get("/api/progress/gantt")
@@ -176,8 +164,7 @@ def progress_gantt():
 
 @app.get("/api/progress/dailyRings")
 def progress_daily_rings():
-    rows = supa.get_list("daily_rings", order="ts.asc", limit=300, ttl=10) if USE_SUPABASE else []
-    series = fmt_ts_value(rows)
+    series = ts_sync.series("daily_rings", ttl=10) if USE_SUPABASE else []
     if not series:
         base = datetime.now(timezone.utc)
         series = [{"ts": (base.replace(microsecond=0).isoformat()), "value": 3 + (i % 4)} for i in range(60)]
@@ -185,17 +172,7 @@ def progress_daily_rings():
 
 @app.get("/api/safety/risks")
 def safety_risks():
-    rows = supa.get_list("risks", order="ts.desc", limit=100, ttl=10) if USE_SUPABASE else []
-    result = []
-    for r in rows:
-        result.append({
-            "level": r.get("level", ""),
-            "name": r.get("name", ""),
-            "status": r.get("status", ""),
-            "desc": r.get("description", ""),
-            "code": r.get("code", ""),
-            "ts": r.get("ts", "")
-        })
+    result = queries.run(supa, queries.SAFETY_RISKS, ttl=10, stale_ttl=STALE_TTL) if USE_SUPABASE else []
     if not result:
         now = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
         result = [
@@ -208,8 +185,7 @@ def safety_risks():
 @app.get("/api/safety/settlement")
 def safety_settlement():
     if USE_SUPABASE:
-        actual = fmt_ts_value(supa.get_list("settlement_actual", order="ts.asc", limit=300, ttl=10))
-        predict = fmt_ts_value(supa.get_list("settlement_predict", order="ts.asc", limit=300, ttl=10))
+        actual, predict = ts_sync.series_many(["settlement_actual", "settlement_predict"], ttl=10)
     else:
         actual, predict = [], []
     if not actual:
@@ -226,8 +202,7 @@ def safety_score():
 
 @app.get("/api/safety/alarmTrend")
 def safety_alarm_trend():
-    rows = supa.get_list("alarm_trend", order="ts.asc", limit=300, ttl=10) if USE_SUPABASE else []
-    series = fmt_ts_value(rows)
+    series = ts_sync.series("alarm_trend", ttl=10) if USE_SUPABASE else []
     if not series:
         base = datetime.now(timezone.utc)
         series = [{"ts": (base.replace(microsecond=0).isoformat()), "value": (i % 5)} for i in range(60)]
@@ -235,10 +210,14 @@ def safety_alarm_trend():
 
 @app.get("/api/safety/verify")
 def safety_verify():
-    a_count = supa.count("settlement_actual", ttl=5)
-    r_count = supa.count("risks", ttl=5)
-    sample_actual = supa.get_list("settlement_actual", limit=1, ttl=5)
-    sample_risk = supa.get_list("risks", limit=1, ttl=5)
+    # 四项同批并发：settlement_actual 计数由增量同步维护（同步与定期校准也在池中执行），
+    # sample_actual 保持整行；risks 使用 estimated 计数避免全表扫描
+    a_count, r_count, sample_actual, sample_risk = supa.get_many([
+        (lambda: ts_sync.count("settlement_actual", ttl=5), 0),
+        {"op": "count", "table": "risks", "ttl": 5, "mode": "estimated"},
+        {"table": "settlement_actual", "limit": 1, "ttl": 5},
+        {"table": "risks", "limit": 1, "ttl": 5},
+    ])
     return jsonify({
         "settlement_actual_count": a_count,
         "risks_count": r_count,
@@ -279,15 +258,20 @@ def video_add():
 @app.get("/api/stream/<topic>")
 def stream_topic(topic):
     print("[sse] subscribe topic=", topic)
-    def event_stream(q):
-        yield "event: heartbeat\ndata: ok\n\n"
-        while True:
-            item = q.get()
-            data = json.dumps(item, ensure_ascii=False)
-            print("[sse] send topic=", topic, "payload_len=", len(data))
-            yield f"event: message\ndata: {data}\n\n"
-    q = sse_hub.subscribe(topic)
-    return Response(event_stream(q), mimetype="text/event-stream")
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("lastEventId")
+    q = sse_hub.subscribe(topic, last_event_id=last_event_id)
+    return Response(sse_hub.stream(q), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/api/stream")
+def stream_multi():
+    topics = parse_list(request.args.get("topics"))
+    if not topics:
+        return jsonify({"error": "topics required"}), 400
+    channels = parse_list(request.args.get("channels"))
+    print("[sse] subscribe topics=", topics, "channels=", channels)
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("lastEventId")
+    q = sse_hub.subscribe(topics, last_event_id=last_event_id, channels=channels)
+    return Response(sse_hub.stream(q), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 @app.post("/api/dev/push-risk")
 def dev_push_risk():
@@ -365,11 +349,12 @@ def ai_deepseek():
 
 @app.post("/api/agent/analyze")
 def agent_analyze():
-    """触发智能体分析风险事件"""
+    """触发智能体分析风险事件；body.async=true 或 ?async=1 时入队后立即返回 202 与 job_id"""
     body = request.get_json(silent=True) or {}
     risk_type = body.get("risk_type", "")
     sensor_data = body.get("sensor_data", {})
     location = body.get("location", "")
+    run_async = bool(body.get("async")) or request.args.get("async", "0") == "1"
     
     if not risk_type:
         return jsonify({"error": "risk_type is required"}), 400
@@ -423,6 +408,14 @@ def agent_analyze():
                 "diagnostics": diagnostics
             })
 
+        if run_async:
+            # 分析在智能体任务队列中执行，进度经 agent-status 推送，结果通过 /api/agent/jobs/<id> 查询
+            # 主动请求携带最新传感器数据，不复用去重窗口内已完成的旧结果
+            job, status = agent_jobs.submit(risk_type, sensor_data, location, dedup=False)
+            if job is None:
+                return jsonify({"error": "agent job queue is full"}), 503
+            return jsonify({"success": True, "job_id": job.id, "status": status, "state": job.state}), 202
+
         from agent import run_agent
         result = run_agent(risk_type, sensor_data, location)
         
@@ -448,6 +441,14 @@ def agent_analyze():
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+@app.get("/api/agent/jobs/<job_id>")
+def agent_job_detail(job_id):
+    # 其他 worker 提交的任务由 agent-status 广播重建状态，任一 worker 都能查询
+    job = agent_jobs.lookup(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify({"success": True, **job})
+
 @app.post("/api/agent/chat")
 def agent_chat():
     """与智能体对话"""
@@ -559,21 +560,15 @@ def agent_episodes_list():
     risk_type = request.args.get("risk_type", None)
     
     try:
-        from agent.memory import get_memory
-        memory = get_memory()
-        
-        # 使用 Supabase 直接查询
-        if memory._client:
+        # 使用共享 Supabase 客户端直接查询
+        if supa.configured:
             query_params = {"select": "id,risk_type,risk_level,location,analysis_result,decision_plan,created_at,execution_status", "order": "created_at.desc", "limit": str(limit)}
             if risk_type:
                 query_params["risk_type"] = f"eq.{risk_type}"
             
-            import requests
-            url = f"{memory._client.url}/rest/v1/agent_episodes"
-            headers = {"apikey": memory._client.key, "Authorization": f"Bearer {memory._client.key}"}
-            r = requests.get(url, headers=headers, params=query_params, timeout=5)
+            r = supa.request("GET", "agent_episodes", params=query_params)
             
-            if r.status_code == 200:
+            if r is not None and r.status_code == 200:
                 episodes = r.json()
                 return jsonify({"success": True, "episodes": episodes, "count": len(episodes)})
         
@@ -587,16 +582,10 @@ def agent_episodes_list():
 def agent_episode_detail(episode_id):
     """获取单个事件详情"""
     try:
-        from agent.memory import get_memory
-        memory = get_memory()
-        
-        if memory._client:
-            import requests
-            url = f"{memory._client.url}/rest/v1/agent_episodes"
-            headers = {"apikey": memory._client.key, "Authorization": f"Bearer {memory._client.key}"}
-            r = requests.get(url, headers=headers, params={"id": f"eq.{episode_id}"}, timeout=5)
+        if supa.configured:
+            r = supa.request("GET", "agent_episodes", params={"id": f"eq.{episode_id}"})
             
-            if r.status_code == 200:
+            if r is not None and r.status_code == 200:
                 data = r.json()
                 if data:
                     return jsonify({"success": True, "episode": data[0]})
@@ -619,20 +608,7 @@ def create_work_order():
         return jsonify({"error": "episode_id is required"}), 400
     
     try:
-        from agent.memory import get_memory
-        memory = get_memory()
-        
-        if memory._client:
-            import requests
-            from datetime import datetime, timezone
-            
-            url = f"{memory._client.url}/rest/v1/work_orders"
-            headers = {
-                "apikey": memory._client.key, 
-                "Authorization": f"Bearer {memory._client.key}",
-                "Content-Type": "application/json",
-                "Prefer": "return=representation"
-            }
+        if supa.configured:
             payload = {
                 "episode_id": episode_id,
                 "assignee": assignee,
@@ -640,14 +616,14 @@ def create_work_order():
                 "status": "open",
                 "notes": notes
             }
-            r = requests.post(url, headers=headers, json=payload, timeout=5)
+            r = supa.request("POST", "work_orders", json=payload, prefer="return=representation")
             
-            if r.status_code in [200, 201]:
+            if r is not None and r.status_code in [200, 201]:
                 result = r.json()
                 work_order_id = result[0]["id"] if result else None
                 return jsonify({"success": True, "work_order_id": work_order_id, "status": "created"})
             else:
-                return jsonify({"error": f"Supabase error: {r.text}"}), 500
+                return jsonify({"error": f"Supabase error: {r.text if r is not None else 'request failed'}"}), 500
         
         return jsonify({"error": "Memory not available"}), 500
     except Exception as e:
@@ -662,20 +638,14 @@ def list_work_orders():
     status = request.args.get("status", None)
     
     try:
-        from agent.memory import get_memory
-        memory = get_memory()
-        
-        if memory._client:
-            import requests
+        if supa.configured:
             query_params = {"select": "*", "order": "created_at.desc", "limit": str(limit)}
             if status:
                 query_params["status"] = f"eq.{status}"
             
-            url = f"{memory._client.url}/rest/v1/work_orders"
-            headers = {"apikey": memory._client.key, "Authorization": f"Bearer {memory._client.key}"}
-            r = requests.get(url, headers=headers, params=query_params, timeout=5)
+            r = supa.request("GET", "work_orders", params=query_params)
             
-            if r.status_code == 200:
+            if r is not None and r.status_code == 200:
                 return jsonify({"success": True, "work_orders": r.json()})
         
         return jsonify({"success": True, "work_orders": []})
@@ -685,21 +655,35 @@ def list_work_orders():
 @app.get("/api/health")
 def health():
     status = "ok"
-    return jsonify({"status": status, "useSupabase": USE_SUPABASE})
+    return jsonify({"status": status, "useSupabase": USE_SUPABASE, "supabase": supa.stats(), "sse": sse_hub.stats()})
+
+@app.get("/api/admin/sse")
+def admin_sse():
+    detail = sorted(sse_hub.subscriber_stats(), key=lambda st: st["lag"], reverse=True)
+    return jsonify({**sse_hub.stats(), "byTopic": sse_hub.topic_stats(), "detail": detail})
+
+@app.get("/api/admin/scheduler")
+def admin_scheduler():
+    from scheduler import scheduler_stats
+    stats = scheduler_stats()
+    return jsonify({"running": stats is not None, "role": sse_hub.broker.role, **(stats or {})})
+
+@app.get("/api/admin/agent-jobs")
+def admin_agent_jobs():
+    return jsonify(agent_jobs.stats())
+
+@app.get("/api/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype=None, content_type=metrics.CONTENT_TYPE)
 
 @app.get("/api/agent/work-orders/by-episode/<episode_id>")
 def list_work_orders_by_episode(episode_id):
     limit = request.args.get("limit", 20, type=int)
     try:
-        from agent.memory import get_memory
-        memory = get_memory()
-        if memory._client:
-            import requests
-            url = f"{memory._client.url}/rest/v1/work_orders"
-            headers = {"apikey": memory._client.key, "Authorization": f"Bearer {memory._client.key}"}
+        if supa.configured:
             query_params = {"select": "*", "order": "created_at.desc", "limit": str(limit), "episode_id": f"eq.{episode_id}"}
-            r = requests.get(url, headers=headers, params=query_params, timeout=5)
-            if r.status_code == 200:
+            r = supa.request("GET", "work_orders", params=query_params)
+            if r is not None and r.status_code == 200:
                 return jsonify({"success": True, "work_orders": r.json()})
         return jsonify({"success": True, "work_orders": []})
     except Exception as e:
@@ -0,0 +1,9 @@
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app as flask_app, sse_hub
+from sse_asgi import SseAsgiApp
+
+# ASGI 入口：/api/stream 与 /api/stream/* 由事件循环直接服务，其余请求经 WsgiToAsgi 转交 Flask（在线程池中执行）
+# 启动：uvicorn asgi:application --host 0.0.0.0 --port 8081
+
+application = SseAsgiApp(sse_hub, WsgiToAsgi(flask_app))
@@ -0,0 +1,300 @@
+import os
+import json
+import time
+import socket
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# SSE 消息总线：SseHub.broadcast 经 broker 发布，由 broker 回调 hub 的本地投递
+# - LocalBroker：单进程，直接回调
+# - UnixSocketBroker：多 worker（gunicorn）共享，无需外部服务
+#     文件锁选主：持有锁的进程为 leader，监听 Unix socket；其余 worker 作为 follower 连接 leader
+#     所有发布先送到 leader，由 leader 统一分配事件 ID 后转发给全部 worker（含自身），
+#     各 worker 的回放缓冲区与 Last-Event-ID 因此一致；leader 退出后 follower 重新竞选
+#     只有 leader 执行 on_leader 注册的回调（调度器轮询）
+#     follower 在本地订阅数变化时上报 presence，leader 汇总全部 worker 的订阅数，用于按需轮询
+# 注意：broker 线程在 import 时启动，gunicorn 不要使用 --preload（fork 后线程不会保留）
+
+
+class LocalBroker:
+    role = "local"
+
+    def __init__(self):
+        self._deliver = None
+
+    @property
+    def is_leader(self) -> bool:
+        return True
+
+    def start(self, deliver, on_presence=None):
+        self._deliver = deliver
+
+    def on_leader(self, fn):
+        fn()
+
+    def report_presence(self, counts):
+        pass
+
+    def remote_counts(self):
+        return {}
+
+    def publish(self, msg):
+        self._deliver(msg)
+
+    def stats(self):
+        return {"role": self.role}
+
+
+class UnixSocketBroker:
+    def __init__(self, path: str, lock_path: str, retry: float = 0.5, send_timeout: float = 2.0):
+        self.path = path
+        self.lock_path = lock_path
+        self.retry = retry
+        self.send_timeout = send_timeout
+        self.role = "starting"
+        self._deliver = None
+        self._lock_file = None
+        self._leader_callbacks = []
+        self._lock = threading.Lock()
+        self._peers = set()
+        self._on_presence = None
+        self._peer_counts = {}
+        self._local_counts = {}
+        self._upstream = None
+        self._upstream_lock = threading.Lock()
+        self._next_id = int(time.time() * 1000)
+        self.relayed = 0
+        self.elections = 0
+        self.fallbacks = 0
+
+    @property
+    def is_leader(self) -> bool:
+        return self.role == "leader"
+
+    def start(self, deliver, on_presence=None):
+        self._deliver = deliver
+        self._on_presence = on_presence
+        threading.Thread(target=self._run, name="sse-broker", daemon=True).start()
+
+    def on_leader(self, fn):
+        with self._lock:
+            self._leader_callbacks.append(fn)
+            leader = self.is_leader
+        if leader:
+            fn()
+
+    # ---------------- 订阅数汇总 ----------------
+
+    def report_presence(self, counts):
+        """本进程订阅数变化时调用；follower 上报给 leader。"""
+        self._local_counts = dict(counts)
+        if self.is_leader:
+            return
+        with self._upstream_lock:
+            conn = self._upstream
+            if conn is not None:
+                try:
+                    conn.sendall(_encode({"type": "presence", "counts": self._local_counts}))
+                except OSError:
+                    self._drop_upstream(conn)
+
+    def remote_counts(self):
+        """其他 worker 的订阅数之和（仅 leader 有数据）。"""
+        total = {}
+        with self._lock:
+            for counts in self._peer_counts.values():
+                for t, n in counts.items():
+                    total[t] = total.get(t, 0) + n
+        return total
+
+    def _presence_changed(self):
+        if self._on_presence is not None:
+            try:
+                self._on_presence()
+            except Exception as e:
+                print("[broker] presence callback error:", e)
+
+    # ---------------- 发布 ----------------
+
+    def publish(self, msg):
+        if self.is_leader:
+            self._relay(msg)
+            return
+        line = _encode(msg)
+        with self._upstream_lock:
+            conn = self._upstream
+            if conn is not None:
+                try:
+                    conn.sendall(line)
+                    return
+                except OSError:
+                    self._drop_upstream(conn)
+        # 选主切换期间没有可用的 leader：只投递给本进程的订阅者
+        self.fallbacks += 1
+        self._deliver(msg)
+
+    def _relay(self, msg):
+        with self._lock:
+            self._next_id += 1
+            msg = {**msg, "id": self._next_id}
+            self._deliver(msg)
+            line = _encode(msg)
+            self.relayed += 1
+            # 在锁内写出，保证各 follower 收到的顺序与 ID 顺序一致且行不交错；慢 follower 受 send_timeout 约束
+            dead = []
+            for conn in self._peers:
+                try:
+                    conn.sendall(line)
+                except OSError:
+                    dead.append(conn)
+        for conn in dead:
+            self._drop_peer(conn)
+
+    # ---------------- 选主与连接 ----------------
+
+    def _run(self):
+        while True:
+            if self._try_lead():
+                return
+            conn = self._connect()
+            if conn is not None:
+                self.role = "follower"
+                print("[broker] follower connected", self.path)
+                self._read_loop(conn, self._on_upstream)
+                self._drop_upstream(conn)
+                print("[broker] leader connection lost, re-electing")
+            time.sleep(self.retry)
+
+    def _try_lead(self) -> bool:
+        f = open(self.lock_path, "a+")
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self._lock_file = f
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        server.listen(64)
+        self.elections += 1
+        with self._lock:
+            self.role = "leader"
+            callbacks = list(self._leader_callbacks)
+        print("[broker] elected leader pid=", os.getpid(), self.path)
+        threading.Thread(target=self._accept_loop, args=(server,), name="sse-broker-accept", daemon=True).start()
+        for fn in callbacks:
+            try:
+                fn()
+            except Exception as e:
+                print("[broker] leader callback error:", e)
+        return True
+
+    def _connect(self):
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(self.path)
+        except OSError:
+            conn.close()
+            return None
+        conn.settimeout(self.send_timeout)
+        with self._upstream_lock:
+            self._upstream = conn
+            try:
+                conn.sendall(_encode({"type": "presence", "counts": self._local_counts}))
+            except OSError:
+                pass
+        return conn
+
+    def _on_upstream(self, msg):
+        # 记录 leader 分配过的最大 ID，自己当选后从其之后继续编号
+        self._next_id = max(self._next_id, msg.get("id") or 0)
+        self._deliver(msg)
+
+    def _drop_upstream(self, conn):
+        if self._upstream is conn:
+            self._upstream = None
+        try:
+            conn.close()
+        except OSError:
+            pass
+
+    def _accept_loop(self, server):
+        while True:
+            conn, _ = server.accept()
+            conn.settimeout(self.send_timeout)
+            with self._lock:
+                self._peers.add(conn)
+            threading.Thread(target=self._serve_peer, args=(conn,), name="sse-broker-peer", daemon=True).start()
+
+    def _serve_peer(self, conn):
+        def handle(msg):
+            if msg.get("type") == "presence":
+                with self._lock:
+                    self._peer_counts[conn] = msg.get("counts") or {}
+                self._presence_changed()
+            else:
+                self._relay(msg)
+        self._read_loop(conn, handle)
+        self._drop_peer(conn)
+
+    def _drop_peer(self, conn):
+        with self._lock:
+            self._peers.discard(conn)
+            had_counts = self._peer_counts.pop(conn, None)
+        if had_counts:
+            self._presence_changed()
+        try:
+            conn.close()
+        except OSError:
+            pass
+
+    def _read_loop(self, conn, handle):
+        buf = b""
+        while True:
+            try:
+                chunk = conn.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            if not chunk:
+                return
+            buf += chunk
+            *lines, buf = buf.split(b"\n")
+            for line in lines:
+                if not line:
+                    continue
+                try:
+                    handle(json.loads(line))
+                except Exception as e:
+                    print("[broker] bad message:", e)
+
+    def stats(self):
+        with self._lock:
+            peers = len(self._peers)
+        return {"role": self.role, "peers": peers, "relayed": self.relayed,
+                "elections": self.elections, "fallbacks": self.fallbacks}
+
+
+def _encode(msg) -> bytes:
+    return json.dumps(msg, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def create_broker(kind: str = None):
+    """SSE_BROKER=local（默认）| unix；unix 在不支持文件锁或 Unix socket 的平台上退回 local。"""
+    kind = (kind or os.getenv("SSE_BROKER", "local")).lower()
+    if kind == "unix":
+        if fcntl is None or not hasattr(socket, "AF_UNIX"):
+            print("[broker] unix broker unsupported on this platform, using local")
+            return LocalBroker()
+        base = os.getenv("SSE_BROKER_PATH", "/tmp/tunnel-sse")
+        return UnixSocketBroker(base + ".sock", base + ".lock")
+    return LocalBroker()
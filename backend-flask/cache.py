@@ -1,34 +1,175 @@
+import os
+import sys
+import json
 import time
-from threading import RLock
+import zlib
+from collections import OrderedDict
+from threading import Lock
+import metrics
 
-_store = {}
-_lock = RLock()
+# 有界 LRU + TTL 缓存引擎
+# - 条目数与字节预算上限，超出时按 LRU 淘汰
+# - max_age 为硬过期时间：超过后条目被回收，get_last 也不再返回
+# - get(key, ttl) 的 ttl 只是调用方的“新鲜度”要求，过期但未回收的条目仍作为 last-known-good 供降级使用
+# - 按 key 哈希分段加锁（lock striping），减少多线程争用
 
-def set(key, value):
-    ts = time.time()
-    with _lock:
-        _store[key] = (value, ts)
-    return True
+MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "2048"))
+MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+MAX_AGE = float(os.getenv("CACHE_MAX_AGE", "86400"))
+STRIPES = max(1, int(os.getenv("CACHE_STRIPES", "16")))
 
-def get(key, ttl=None):
-    with _lock:
-        v = _store.get(key)
-        if not v:
+
+def _sizeof(value):
+    if value is None:
+        return 16
+    if isinstance(value, (bytes, str)):
+        return sys.getsizeof(value)
+    if isinstance(value, (int, float, bool)):
+        return 32
+    try:
+        return len(json.dumps(value, ensure_ascii=False, default=str)) * 2
+    except Exception:
+        return sys.getsizeof(value)
+
+
+class _Stripe:
+    __slots__ = ("lock", "entries", "bytes", "max_entries", "max_bytes", "evictions")
+
+    def __init__(self, max_entries, max_bytes):
+        self.lock = Lock()
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evictions = 0
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+        return entry
+
+    def _evict(self, now):
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            expired = now - entry[1] > MAX_AGE
+            if not expired and len(self.entries) <= self.max_entries and self.bytes <= self.max_bytes:
+                break
+            self._drop(key)
+            self.evictions += 1
+
+
+_M_LOOKUPS = metrics.counter("cache_lookups_total", "Cache engine lookups by result", ("result",))
+
+
+class CacheEngine:
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, stripes=STRIPES):
+        self.stripes = [
+            _Stripe(max(1, max_entries // stripes), max(1, max_bytes // stripes))
+            for _ in range(stripes)
+        ]
+
+    def _stripe(self, key):
+        return self.stripes[zlib.crc32(str(key).encode("utf-8")) % len(self.stripes)]
+
+    def set(self, key, value, size=None):
+        now = time.time()
+        size = size if size is not None else _sizeof(value)
+        s = self._stripe(key)
+        with s.lock:
+            if size > s.max_bytes:
+                # 超出单段字节预算的值不缓存，保留原有条目作为 last-known-good
+                return False
+            s._drop(key)
+            s.entries[key] = (value, now, size)
+            s.bytes += size
+            s._evict(now)
+        return True
+
+    def entry(self, key):
+        """返回 (value, ts)；不存在或已硬过期时返回 None。命中会刷新 LRU 顺序。"""
+        s = self._stripe(key)
+        now = time.time()
+        with s.lock:
+            entry = s.entries.get(key)
+            if entry is not None and now - entry[1] > MAX_AGE:
+                s._drop(key)
+                s.evictions += 1
+                entry = None
+            if entry is not None:
+                s.entries.move_to_end(key)
+        if entry is None:
             return None
-        value, ts = v
-    if ttl is None:
-        return value
-    if time.time() - ts <= ttl:
-        return value
-    return None
+        return entry[0], entry[1]
+
+    def delete(self, key):
+        s = self._stripe(key)
+        with s.lock:
+            return s._drop(key) is not None
+
+    def clear(self):
+        for s in self.stripes:
+            with s.lock:
+                s.entries.clear()
+                s.bytes = 0
+
+    def stats(self):
+        entries = 0
+        size = 0
+        evictions = 0
+        for s in self.stripes:
+            with s.lock:
+                entries += len(s.entries)
+                size += s.bytes
+                evictions += s.evictions
+        return {"entries": entries, "bytes": size, "evictions": evictions, "stripes": len(self.stripes)}
+
+
+_engine = CacheEngine()
+
+metrics.gauge("cache_entries", "Resident cache entries", lambda: _engine.stats()["entries"])
+metrics.gauge("cache_bytes", "Estimated bytes held by the cache", lambda: _engine.stats()["bytes"])
+metrics.gauge("cache_evictions_total", "Entries evicted by LRU, byte budget or max age", lambda: _engine.stats()["evictions"], kind="counter")
+
+
+def set(key, value, size=None):
+    return _engine.set(key, value, size)
+
+
+def get(key, ttl=None, record=True):
+    """按新鲜度读取；cache_lookups_total 在 ttl 判断之后计数（超过 ttl 记为 miss）。
+    record=False 用于同一次读取内的复查（如 single-flight 内的二次检查），不重复计数。"""
+    e = _engine.entry(key)
+    value = None
+    if e is not None and (ttl is None or time.time() - e[1] <= ttl):
+        value = e[0]
+    if record:
+        _M_LOOKUPS.inc(result="hit" if value is not None else "miss")
+    return value
+
+
+def get_entry(key):
+    return _engine.entry(key)
+
 
 def get_last(key):
-    with _lock:
-        v = _store.get(key)
-        if not v:
-            return None
-        return v[0]
+    e = _engine.entry(key)
+    if e is None:
+        return None
+    return e[0]
+
 
 def has(key):
-    with _lock:
-        return key in _store
+    return _engine.entry(key) is not None
+
+
+def delete(key):
+    return _engine.delete(key)
+
+
+def clear():
+    _engine.clear()
+
+
+def stats():
+    return _engine.stats()
@@ -0,0 +1,80 @@
+import os
+import time
+import threading
+
+# 熔断器：closed → 连续失败达到阈值 → open（快速失败）→ 冷却后 half_open（放行少量探测请求）
+# 探测成功则恢复 closed，失败则重新 open
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = None, reset_timeout: float = None, half_open_max: int = None):
+        self.name = name
+        self.failure_threshold = failure_threshold or int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+        self.reset_timeout = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "15")) if reset_timeout is None else reset_timeout
+        self.half_open_max = half_open_max or int(os.getenv("CIRCUIT_HALF_OPEN_MAX", "1"))
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == OPEN and time.time() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and self._probes < self.half_open_max:
+                self._probes += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._probes = 0
+
+    def record_failure(self):
+        with self._lock:
+            state = self._current_state()
+            self._failures += 1
+            if state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if state != OPEN:
+                    self.opened += 1
+                self._state = OPEN
+                self._opened_at = time.time()
+                self._probes = 0
+
+    def stats(self):
+        with self._lock:
+            state = self._current_state()
+            retry_in = max(0.0, self.reset_timeout - (time.time() - self._opened_at)) if state == OPEN else 0.0
+            return {
+                "state": state,
+                "failures": self._failures,
+                "opened": self.opened,
+                "rejected": self.rejected,
+                "retry_in": round(retry_in, 3),
+            }
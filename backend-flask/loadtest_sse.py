@@ -0,0 +1,170 @@
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from urllib.parse import urlsplit
+
+from sse import SseHub
+from sse_asgi import SseAsgiApp
+
+# SSE 压测：
+#   进程内模式（默认）：直接驱动 SseAsgiApp，统计每个客户端的内存占用、线程数与投递完整性
+#     python loadtest_sse.py --clients 5000 --events 20
+#   远程模式：对运行中的服务（uvicorn asgi:application）建立真实 TCP 连接
+#     python loadtest_sse.py --url http://127.0.0.1:8081/api/stream/dashboard --clients 2000
+
+
+async def _not_found(scope, receive, send):
+    await send({"type": "http.response.start", "status": 404, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+class _Client:
+    __slots__ = ("frames", "bytes", "done", "last_at")
+
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+        self.done = None
+        self.last_at = 0.0
+
+    def feed(self, chunk: bytes):
+        self.bytes += len(chunk)
+        self.frames += chunk.count(b"\nevent: message\n")
+        self.last_at = time.perf_counter()
+
+
+async def run_inprocess(clients: int, events: int, interval: float, topic: str, timeout: float):
+    hub = SseHub(idle_timeout=0, max_lag=0)
+    app = SseAsgiApp(hub, _not_found)
+    loop = asyncio.get_running_loop()
+    tracemalloc.start()
+    base_mem = tracemalloc.get_traced_memory()[0]
+    threads_before = threading.active_count()
+
+    stats = []
+    tasks = []
+    for _ in range(clients):
+        c = _Client()
+        c.done = loop.create_future()
+        stats.append(c)
+
+        async def receive(c=c):
+            await c.done
+            return {"type": "http.disconnect"}
+
+        async def send(message, c=c):
+            if message["type"] == "http.response.body":
+                c.feed(message.get("body", b""))
+
+        scope = {"type": "http", "method": "GET", "path": f"/api/stream/{topic}", "query_string": b"", "headers": []}
+        tasks.append(loop.create_task(app(scope, receive, send)))
+
+    while hub.subscriber_counts().get(topic, 0) < clients:
+        await asyncio.sleep(0.05)
+    connected_mem = tracemalloc.get_traced_memory()[0]
+    threads_connected = threading.active_count()
+
+    payload = {"value": 1.23, "ts": "2025-01-01T00:00:00Z"}
+
+    def produce():
+        for i in range(events):
+            hub.broadcast(topic, "risk", {**payload, "seq": i})
+            time.sleep(interval)
+
+    started = time.perf_counter()
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    deadline = started + timeout
+    while time.perf_counter() < deadline and any(c.frames < events for c in stats):
+        await asyncio.sleep(0.05)
+    producer.join()
+    elapsed = time.perf_counter() - started
+    peak_mem = tracemalloc.get_traced_memory()[1]
+
+    for c in stats:
+        c.done.set_result(None)
+    await asyncio.gather(*tasks, return_exceptions=True)
+    tracemalloc.stop()
+
+    complete = sum(1 for c in stats if c.frames >= events)
+    last = max((c.last_at for c in stats), default=started) - started
+    return {
+        "clients": clients,
+        "events": events,
+        "complete_clients": complete,
+        "elapsed_s": round(elapsed, 3),
+        "last_delivery_s": round(last, 3),
+        "frames_per_s": round(sum(c.frames for c in stats) / max(elapsed, 1e-9)),
+        "mem_per_client_kb": round((connected_mem - base_mem) / clients / 1024, 2),
+        "peak_mem_mb": round(peak_mem / 1024 / 1024, 2),
+        "extra_threads": threads_connected - threads_before,
+        "leaked_subscribers": sum(hub.subscriber_counts().values()),
+    }
+
+
+async def _remote_client(host, port, path, c: _Client, stop: asyncio.Event):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nAccept: text/event-stream\r\n\r\n".encode())
+    await writer.drain()
+    try:
+        while not stop.is_set():
+            chunk = await reader.read(65536)
+            if not chunk:
+                break
+            c.feed(chunk)
+    finally:
+        writer.close()
+
+
+async def run_remote(url: str, clients: int, duration: float):
+    u = urlsplit(url)
+    path = u.path + (f"?{u.query}" if u.query else "")
+    stop = asyncio.Event()
+    stats = [_Client() for _ in range(clients)]
+    tasks = [asyncio.ensure_future(_remote_client(u.hostname, u.port or 80, path, c, stop)) for c in stats]
+    await asyncio.sleep(duration)
+    stop.set()
+    for t in tasks:
+        t.cancel()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    failed = sum(1 for r in results if isinstance(r, Exception) and not isinstance(r, asyncio.CancelledError))
+    frames = [c.frames for c in stats]
+    return {
+        "clients": clients,
+        "duration_s": duration,
+        "connect_failures": failed,
+        "receiving_clients": sum(1 for c in stats if c.bytes > 0),
+        "frames_min": min(frames),
+        "frames_max": max(frames),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SSE 并发压测")
+    parser.add_argument("--clients", type=int, default=int(os.getenv("LOADTEST_CLIENTS", "2000")))
+    parser.add_argument("--events", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.05)
+    parser.add_argument("--topic", default="dashboard")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--url", help="压测运行中的服务，而非进程内应用")
+    parser.add_argument("--duration", type=float, default=30, help="远程模式的持续时间（秒）")
+    args = parser.parse_args()
+
+    if args.url:
+        result = asyncio.run(run_remote(args.url, args.clients, args.duration))
+        ok = result["connect_failures"] == 0 and result["receiving_clients"] == args.clients
+    else:
+        result = asyncio.run(run_inprocess(args.clients, args.events, args.interval, args.topic, args.timeout))
+        ok = result["complete_clients"] == args.clients and result["leaked_subscribers"] == 0 and result["extra_threads"] <= 0
+    for k, v in result.items():
+        print(f"{k:>20}: {v}")
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
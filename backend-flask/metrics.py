@@ -0,0 +1,165 @@
+import math
+import threading
+
+# 轻量指标注册表：计数器、直方图与回调型 gauge，按 Prometheus 文本格式 (0.0.4) 导出
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _fmt_value(v):
+    if v == math.inf:
+        return "+Inf"
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return repr(v) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        k = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[k] = self._values.get(k, 0) + amount
+
+    def value(self, **labels):
+        k = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            return self._values.get(k, 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, _fmt_labels(self.labelnames, k), v) for k, v in items]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        k = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            h = self._values.get(k)
+            if h is None:
+                h = self._values[k] = [[0] * len(self.buckets), 0.0, 0]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    h[0][i] += 1
+                    break
+            h[1] += value
+            h[2] += 1
+
+    def snapshot(self, **labels):
+        """返回 {"count", "sum", "buckets": [(le, 累计次数)]}，供管理接口展示。"""
+        k = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            h = self._values.get(k)
+            if h is None:
+                return {"count": 0, "sum": 0.0, "buckets": []}
+            counts, total, n = list(h[0]), h[1], h[2]
+        acc, out = 0, []
+        for b, c in zip(self.buckets, counts):
+            acc += c
+            out.append((b, acc))
+        return {"count": n, "sum": total, "buckets": out}
+
+    def samples(self):
+        with self._lock:
+            items = [(k, list(h[0]), h[1], h[2]) for k, h in self._values.items()]
+        out = []
+        for k, counts, total, n in items:
+            acc = 0
+            for b, c in zip(self.buckets, counts):
+                acc += c
+                out.append((f"{self.name}_bucket", _fmt_labels(self.labelnames, k, f'le="{_fmt_value(b)}"'), acc))
+            out.append((f"{self.name}_sum", _fmt_labels(self.labelnames, k), total))
+            out.append((f"{self.name}_count", _fmt_labels(self.labelnames, k), n))
+        return out
+
+
+class Gauge:
+    """回调型指标：导出时调用 fn()，返回数值或 {标签值元组: 数值}；kind 可为 counter，用于导出外部维护的累计值。"""
+
+    def __init__(self, name, help, fn, labelnames=(), kind="gauge"):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+
+    def samples(self):
+        try:
+            v = self.fn()
+        except Exception:
+            return []
+        if isinstance(v, dict):
+            return [(self.name, _fmt_labels(self.labelnames, k if isinstance(k, tuple) else (k,)), x) for k, x in v.items()]
+        return [(self.name, "", v)]
+
+
+def _register(metric):
+    with _registry_lock:
+        existing = _registry.get(metric.name)
+        if existing is not None:
+            return existing
+        _registry[metric.name] = metric
+        return metric
+
+
+def counter(name, help, labelnames=()):
+    return _register(Counter(name, help, labelnames))
+
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(name, help, labelnames, buckets))
+
+
+def gauge(name, help, fn, labelnames=(), kind="gauge"):
+    """同名 gauge 重复注册时以最后一次的回调为准（例如客户端重建）。"""
+    g = Gauge(name, help, fn, labelnames, kind)
+    with _registry_lock:
+        _registry[name] = g
+    return g
+
+
+def render():
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for m in metrics:
+        lines.append(f"# HELP {m.name} {m.help}")
+        lines.append(f"# TYPE {m.name} {m.kind}")
+        for name, labels, value in m.samples():
+            lines.append(f"{name}{labels} {_fmt_value(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,113 @@
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+# 声明式查询规格：列投影、排序、条数与过滤条件下推到 PostgREST
+# columns 使用 PostgREST 的别名语法 "输出字段:数据库列"，返回的行即为接口输出形状，无需在 Python 中逐行重组
+# 若表缺少某列导致投影被拒绝（HTTP 400），自动退回 select=* 并在 Python 中按同一规格整形
+# defaults 与原先 row.get(col, 默认值) 的取值一致，只在列为空或表中没有该列时填入
+# fallbacks 为 select=* 整形时的备用源列（输出字段 -> 旧表列名），兼容旧表结构
+
+
+class QuerySpec:
+    __slots__ = ("table", "columns", "order", "limit", "filters", "defaults", "fallbacks", "select", "_pairs")
+
+    def __init__(self, table: str, columns, order: Optional[str] = "ts.desc", limit: int = 300,
+                 filters: Optional[Dict[str, str]] = None, defaults: Optional[Dict[str, Any]] = None,
+                 fallbacks: Optional[Dict[str, str]] = None):
+        self.table = table
+        self.columns = tuple(columns)
+        self.order = order
+        self.limit = limit
+        self.filters = filters
+        self.defaults = defaults or {}
+        self.fallbacks = fallbacks or {}
+        self.select = ",".join(self.columns)
+        self._pairs = [tuple(c.split(":", 1)) if ":" in c else (c, c) for c in self.columns]
+
+    def shape(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        out = {name: row.get(src) for name, src in self._pairs}
+        for name, src in self.fallbacks.items():
+            if out.get(name) is None:
+                out[name] = row.get(src)
+        return self.fill(out) if self.defaults else out
+
+    def fill(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        if all(row.get(k) is not None for k in self.defaults):
+            return row
+        out = dict(row)
+        for k, v in self.defaults.items():
+            if out.get(k) is None:
+                out[k] = v
+        return out
+
+
+def run(client, spec: QuerySpec, ttl=None, stale_ttl=None, limit: int = None, filters: Dict[str, str] = None) -> List[Dict[str, Any]]:
+    kwargs = {
+        "order": spec.order,
+        "limit": spec.limit if limit is None else limit,
+        "ttl": ttl,
+        "stale_ttl": stale_ttl,
+        "filters": {**(spec.filters or {}), **(filters or {})} or None,
+    }
+    if not client.projection_rejected(spec.table, spec.select):
+        rows = client.get_list(spec.table, select=spec.select, **kwargs)
+        if rows or not client.projection_rejected(spec.table, spec.select):
+            return [spec.fill(r) for r in rows] if spec.defaults else rows
+    rows = client.get_list(spec.table, select="*", **kwargs)
+    return [spec.shape(r) for r in rows]
+
+
+def first(client, spec: QuerySpec, ttl=None, stale_ttl=None) -> Optional[Dict[str, Any]]:
+    rows = run(client, spec, ttl=ttl, stale_ttl=stale_ttl, limit=1)
+    return rows[0] if rows else None
+
+
+@lru_cache(maxsize=None)
+def latest_point(table: str) -> QuerySpec:
+    return QuerySpec(table, ["ts", "value"], limit=1)
+
+
+# ================= 接口查询规格 =================
+
+DASHBOARD_SUMMARY = QuerySpec("summary", [
+    "cameraOnline:camera_online", "cameraTotal:camera_total", "ringToday:ring_today",
+    "ringCumulative:ring_cumulative", "muckToday:muck_today",
+    "slurryPressureAvg:slurry_pressure_avg", "gasAlerts:gas_alerts"
+], limit=1, defaults={
+    "cameraOnline": 0, "cameraTotal": 0, "ringToday": 0, "ringCumulative": 0, "muckToday": 0,
+    "slurryPressureAvg": 0, "gasAlerts": 0,
+})
+
+DASHBOARD_NOTIFICATIONS = QuerySpec("notifications", ["time:ts", "type", "content"], limit=30,
+                                    defaults={"time": "", "type": "", "content": ""})
+
+DASHBOARD_SUPPLIES = QuerySpec("supplies", ["category", "quantity"], order="category.asc", limit=100)
+
+DASHBOARD_DISPATCH = QuerySpec("dispatch", ["time:ts", "type", "unit", "status"], limit=50,
+                               defaults={"time": "", "type": "", "unit": "", "status": ""})
+
+PERSONNEL_STATS = QuerySpec("stats", [
+    "totalOnSite:total_on_site", "attendanceRate:attendance_rate", "violations", "managers"
+], limit=1, defaults={"totalOnSite": 0, "attendanceRate": "0%", "violations": 0, "managers": 0})
+
+PROGRESS_STATS = QuerySpec("stats_progress", [
+    "totalRings:total_rings", "totalGoal:total_goal", "dailyRings:daily_rings",
+    "remainingDays:remaining_days", "value"
+], limit=1, defaults={"totalRings": 0, "totalGoal": 0, "dailyRings": 0, "remainingDays": 0, "value": 0})
+
+SAFETY_RISKS = QuerySpec("risks", ["level", "name", "status", "desc:description", "code", "ts"], limit=100,
+                         defaults={"level": "", "name": "", "status": "", "desc": "", "code": "", "ts": ""})
+
+# 智能体工具：可选列缺失时由 defaults 补齐；旧表的 ch4 / slurry 列经 fallbacks 映射到 value
+SENSOR_GAS = QuerySpec("gas_concentration", ["ts", "value", "co", "o2"], limit=1,
+                       defaults={"co": 0.002, "o2": 20.5},
+                       fallbacks={"value": "ch4"})
+
+SENSOR_PRESSURE = QuerySpec("slurry_pressure", ["ts", "value", "soil_chamber"], limit=1,
+                            defaults={"soil_chamber": 2.45},
+                            fallbacks={"value": "slurry"})
+
+SENSOR_TEMPERATURE = QuerySpec("temperature", ["ts", "ambient", "motor"], limit=1, defaults={"ambient": 28.4, "motor": 65.2})
+
+PERSONNEL_STATS_RAW = QuerySpec("stats", ["total_on_site", "attendance_rate", "managers"], limit=1,
+                                defaults={"total_on_site": 48, "attendance_rate": "92%", "managers": 6})
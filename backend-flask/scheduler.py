@@ -1,177 +1,379 @@
+import os
+import time
+import threading
+from datetime import datetime
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.events import (
+    EVENT_JOB_SUBMITTED, EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES,
+    EVENT_JOB_MODIFIED,
+)
+import metrics
+import queries
+from snapshot import LatestSnapshot
+from timeseries_sync import TimeSeriesSync
+from anomaly import AnomalyDetector
 
-def start_scheduler(supa, hub):
-    scheduler = BackgroundScheduler()
 
-    def push_dashboard():
-        a = supa.get_list("advance_speed", limit=1, ttl=3)
-        s = supa.get_list("slurry_pressure", limit=1, ttl=3)
-        g = supa.get_list("gas_concentration", limit=1, ttl=3)
-        if a:
-            hub.broadcast("dashboard", "dashboard.advanceSpeed", {"ts": a[0].get("ts"), "value": a[0].get("value")})
-        else:
-            hub.broadcast("dashboard", "dashboard.advanceSpeed", {"ts": None, "value": 1.2})
-        if s:
-            hub.broadcast("dashboard", "dashboard.slurryPressure", {"ts": s[0].get("ts"), "value": s[0].get("value")})
-        else:
-            hub.broadcast("dashboard", "dashboard.slurryPressure", {"ts": None, "value": 1.8})
-        if g:
-            hub.broadcast("dashboard", "dashboard.gasConcentration", {"ts": g[0].get("ts"), "value": g[0].get("value")})
-        else:
-            hub.broadcast("dashboard", "dashboard.gasConcentration", {"ts": None, "value": 0.1})
-        summary = supa.get_list("summary", limit=1, ttl=3)
-        if summary:
-            row = summary[0]
-            hub.broadcast("dashboard", "dashboard.summary", {
-                "cameraOnline": row.get("camera_online", 0),
-                "cameraTotal": row.get("camera_total", 0),
-                "ringToday": row.get("ring_today", 0),
-                "ringCumulative": row.get("ring_cumulative", 0),
-                "muckToday": row.get("muck_today", 0),
-                "slurryPressureAvg": row.get("slurry_pressure_avg", 0),
-                "gasAlerts": row.get("gas_alerts", 0)
-            })
-
-    def push_personnel():
-        a = supa.get_list("attendance_trend", limit=1, ttl=3)
-        if a:
-            hub.broadcast("personnel", "personnel.attendanceTrend", {"ts": a[0].get("ts"), "value": a[0].get("value")})
-        else:
-            hub.broadcast("personnel", "personnel.attendanceTrend", {"ts": None, "value": 85})
-        stats = supa.get_list("stats", limit=1, ttl=3)
-        if stats:
-            r = stats[0]
-            hub.broadcast("personnel", "personnel.stats", {
-                "totalOnSite": r.get("total_on_site", 0),
-                "attendanceRate": r.get("attendance_rate", "0%"),
-                "violations": r.get("violations", 0),
-                "managers": r.get("managers", 0)
-            })
-        else:
-            hub.broadcast("personnel", "personnel.stats", {"totalOnSite": 48, "attendanceRate": "92%", "violations": 0, "managers": 6})
+class ChangePublisher:
+    """
+    记住每个通道上次推送的值，只在 ts 或数值变化时广播（回退常量也只推送一次）。
+    delta=True 的对象通道只推送变化的字段，每 keyframe_interval 秒推送一次完整关键帧。
+    """
 
-    def push_progress():
-        d = supa.get_list("daily_rings", limit=1, ttl=3)
-        if d:
-            hub.broadcast("progress", "progress.dailyRings", {"ts": d[0].get("ts"), "value": d[0].get("value")})
-        else:
-            hub.broadcast("progress", "progress.dailyRings", {"ts": None, "value": 4})
-        stats = supa.get_list("stats_progress", limit=1, ttl=3)
-        if stats:
-            r = stats[0]
-            hub.broadcast("progress", "progress.stats", {
-                "totalRings": r.get("total_rings", 0),
-                "totalGoal": r.get("total_goal", 0),
-                "dailyRings": r.get("daily_rings", 0),
-                "remainingDays": r.get("remaining_days", 0),
-                "value": r.get("value", 0)
-            })
-        else:
-            hub.broadcast("progress", "progress.stats", {"totalRings": 130, "totalGoal": 240, "dailyRings": 4, "remainingDays": 28, "value": 54})
+    def __init__(self, hub, keyframe_interval: float = None):
+        self.hub = hub
+        self.keyframe_interval = float(os.getenv("SSE_KEYFRAME_INTERVAL", "30")) if keyframe_interval is None else keyframe_interval
+        self._last = {}
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.deltas = 0
+        self.skipped = 0
 
-    def push_safety():
-        a = supa.get_list("settlement_actual", limit=1, ttl=3)
-        p = supa.get_list("settlement_predict", limit=1, ttl=3)
-        if a:
-            hub.broadcast("safety", "safety.settlement.actual", {"ts": a[0].get("ts"), "value": a[0].get("value")})
-        else:
-            hub.broadcast("safety", "safety.settlement.actual", {"ts": None, "value": 1.0})
-        if p:
-            hub.broadcast("safety", "safety.settlement.predict", {"ts": p[0].get("ts"), "value": p[0].get("value")})
-        else:
-            hub.broadcast("safety", "safety.settlement.predict", {"ts": None, "value": 1.2})
-        alarm = supa.get_list("alarm_trend", limit=1, ttl=3)
-        if alarm:
-            hub.broadcast("safety", "safety.alarmTrend", {"ts": alarm[0].get("ts"), "value": alarm[0].get("value")})
+    def publish(self, topic: str, channel: str, payload, delta: bool = False) -> bool:
+        now = time.time()
+        key = (topic, channel)
+        with self._lock:
+            prev = self._last.get(key)
+            keyframe_due = prev is None or now - prev[1] >= self.keyframe_interval
+            if prev is not None and prev[0] == payload and not (delta and keyframe_due):
+                self.skipped += 1
+                return False
+            if delta and not keyframe_due and isinstance(payload, dict) and isinstance(prev[0], dict):
+                changes = {k: v for k, v in payload.items() if prev[0].get(k) != v}
+                changes.update({k: None for k in prev[0] if k not in payload})
+                self._last[key] = (payload, prev[1])
+                self.deltas += 1
+            else:
+                changes = None
+                self._last[key] = (payload, now)
+            self.sent += 1
+        if changes is None:
+            self.hub.broadcast(topic, channel, payload)
         else:
-            hub.broadcast("safety", "safety.alarmTrend", {"ts": None, "value": 1})
+            self.hub.broadcast(topic, channel, changes, full=payload)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {"sent": self.sent, "deltas": self.deltas, "skipped": self.skipped}
+
+
+# 时序表数据源只取最新一个点；配置了增量同步时从同步缓冲区读取，与异常检测、接口共用同一条拉取路径
+SERIES_TABLES = (
+    "advance_speed", "slurry_pressure", "gas_concentration", "attendance_trend",
+    "daily_rings", "settlement_actual", "settlement_predict", "alarm_trend",
+)
+
+# 轮询数据源：名称 -> 查询规格
+SOURCES = {
+    **{t: queries.latest_point(t) for t in SERIES_TABLES},
+    "summary": queries.DASHBOARD_SUMMARY,
+    "personnel_stats": queries.PERSONNEL_STATS,
+    "progress_stats": queries.PROGRESS_STATS,
+}
+
+
+class PollingPlanner:
+    """
+    统一轮询计划：每个 tick 找出到期的 topic，合并它们需要的数据源，并发查询一次写入快照，
+    再由各 topic 的推送函数从快照读取并广播。
+    - 按需：topic 没有订阅者（含其他 worker）时不参与计划；全部空闲时整个 tick 任务暂停
+    - 自适应：推送函数返回本轮是否有变化；无变化时间隔逐步放大（最多 max_backoff 倍），有变化立即恢复
+    - 传入 series（TimeSeriesSync）时，SERIES_TABLES 中的数据源通过增量同步取最新点，不再单独查询
+    """
+
+    def __init__(self, supa, snapshot, sources=None, tick: float = None, max_backoff: float = None,
+                 demand_driven: bool = None, series=None):
+        self.supa = supa
+        self.snapshot = snapshot
+        self.sources = sources or SOURCES
+        self.series = series
+        self.series_tables = frozenset(SERIES_TABLES) if series is not None else frozenset()
+        self.tick = float(os.getenv("SCHEDULER_TICK", "1")) if tick is None else tick
+        self.max_backoff = float(os.getenv("SCHEDULER_MAX_BACKOFF", "8")) if max_backoff is None else max_backoff
+        if demand_driven is None:
+            demand_driven = os.getenv("SCHEDULER_DEMAND_DRIVEN", "1") == "1"
+        self.demand_driven = demand_driven
+        self._topics = {}
+        self._demand = {}
+        self._lock = threading.Lock()
+        self.ticks = 0
+        self.fetches = 0
+
+    def add_topic(self, topic: str, interval: float, sources, push):
+        self._topics[topic] = {"base": interval, "interval": interval, "due": 0.0,
+                               "sources": tuple(sources), "push": push}
+
+    def set_demand(self, demand) -> bool:
+        """更新订阅数；刚出现订阅者的 topic 下个 tick 立即推送。返回是否有 topic 需要轮询。"""
+        with self._lock:
+            for topic, t in self._topics.items():
+                if demand.get(topic, 0) > 0 and self._demand.get(topic, 0) == 0:
+                    t["interval"], t["due"] = t["base"], 0.0
+            self._demand = dict(demand)
+            return self.active()
+
+    def active(self) -> bool:
+        return not self.demand_driven or any(self._demand.get(t, 0) > 0 for t in self._topics)
+
+    def due_topics(self, now: float):
+        with self._lock:
+            return [topic for topic, t in self._topics.items()
+                    if now >= t["due"] and (not self.demand_driven or self._demand.get(topic, 0) > 0)]
+
+    def run_tick(self):
+        now = time.time()
+        due = self.due_topics(now)
+        self.ticks += 1
+        if not due:
+            return
+        names = sorted({name for topic in due for name in self._topics[topic]["sources"]})
+        # 每个数据源每个 tick 只查询一次；缓存 ttl 与同步间隔取半个 tick，同一周期内的请求可直接复用
+        rows = self.supa.run_concurrently(
+            [lambda n=n: self._fetch(n) for n in names],
+            defaults=[lambda n=n: self.snapshot.get(n) for n in names],
+        )
+        self.fetches += len(names)
+        self.snapshot.put_many(dict(zip(names, rows)))
+        view = self.snapshot.view()
+        for topic in due:
+            t = self._topics[topic]
+            try:
+                changed = t["push"](view)
+            except Exception as e:
+                print(f"[Scheduler] push {topic} failed: {e}")
+                changed = False
+            with self._lock:
+                t["interval"] = t["base"] if changed else min(t["interval"] * 1.5, t["base"] * self.max_backoff)
+                t["due"] = now + t["interval"]
+
+    def _fetch(self, name: str):
+        if name in self.series_tables:
+            return self.series.latest(name, ttl=self.tick / 2)
+        return queries.first(self.supa, self.sources[name], ttl=self.tick / 2)
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            topics = {
+                topic: {"interval": round(t["interval"], 2), "dueIn": round(max(0.0, t["due"] - now), 2),
+                        "subscribers": self._demand.get(topic, 0), "sources": list(t["sources"])}
+                for topic, t in self._topics.items()
+            }
+        return {"ticks": self.ticks, "fetches": self.fetches, "topics": topics, "snapshot": self.snapshot.stats()}
+
+
+_job_duration = metrics.histogram("scheduler_job_duration_seconds", "调度任务单次执行耗时", ("job",))
+_job_runs = metrics.counter("scheduler_job_runs_total", "调度任务执行次数", ("job", "result"))
+_job_skipped = metrics.counter("scheduler_job_skipped_total", "未执行的计划运行次数（misfire/max_instances/coalesced）", ("job", "reason"))
+
+
+class JobMonitor:
+    """
+    调度任务观测：包装任务函数统计耗时与结果，监听 APScheduler 事件统计跳过的运行：
+    - max_instances：上一次还没跑完，本次被丢弃（例如 Supabase 卡顿时 planner 超过 tick）
+    - misfire：超过 misfire_grace_time 未能执行
+    - coalesced：多次错过的运行被合并为一次，按相邻两次计划时间之间缺失的间隔数计算；
+      任务被暂停/恢复（修改）时清空上次计划时间，暂停期间不计入
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._scheduler = None
+
+    def wrap(self, job_id: str, fn, interval: float):
+        with self._lock:
+            self._jobs[job_id] = {"interval": interval, "runs": 0, "errors": 0, "max_instances": 0,
+                                  "misfire": 0, "coalesced": 0, "last_success": None, "last_error": None,
+                                  "last_duration": None, "last_scheduled": None, "running_since": None}
+
+        def run():
+            start = time.time()
+            with self._lock:
+                self._jobs[job_id]["running_since"] = start
+            try:
+                result = fn()
+            except Exception as e:
+                self._finish(job_id, start, error=e)
+                raise
+            self._finish(job_id, start)
+            return result
+        return run
+
+    def _finish(self, job_id, start, error=None):
+        end = time.time()
+        _job_duration.observe(end - start, job=job_id)
+        _job_runs.inc(job=job_id, result="error" if error else "ok")
+        with self._lock:
+            j = self._jobs[job_id]
+            j["runs"] += 1
+            j["last_duration"] = round(end - start, 4)
+            j["running_since"] = None
+            if error is None:
+                j["last_success"] = end
+            else:
+                j["errors"] += 1
+                j["last_error"] = f"{type(error).__name__}: {error}"
+
+    def attach(self, scheduler):
+        self._scheduler = scheduler
+        scheduler.add_listener(self._on_event, EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR
+                               | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MODIFIED)
+
+    def _on_event(self, event):
+        with self._lock:
+            j = self._jobs.get(event.job_id)
+            if j is None:
+                return
+            if event.code == EVENT_JOB_MODIFIED:
+                j["last_scheduled"] = None
+            elif event.code in (EVENT_JOB_SUBMITTED, EVENT_JOB_MAX_INSTANCES):
+                run_time = event.scheduled_run_times[-1].timestamp()
+                if j["last_scheduled"] is not None and j["interval"]:
+                    gap = round((run_time - j["last_scheduled"]) / j["interval"]) - 1
+                    if gap > 0:
+                        j["coalesced"] += gap
+                        _job_skipped.inc(gap, job=event.job_id, reason="coalesced")
+                j["last_scheduled"] = run_time
+                if event.code == EVENT_JOB_MAX_INSTANCES:
+                    j["max_instances"] += 1
+                    _job_skipped.inc(job=event.job_id, reason="max_instances")
+            elif event.code == EVENT_JOB_MISSED:
+                j["misfire"] += 1
+                _job_skipped.inc(job=event.job_id, reason="misfire")
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            jobs = {k: dict(v) for k, v in self._jobs.items()}
+        for job_id, j in jobs.items():
+            job = self._scheduler.get_job(job_id) if self._scheduler else None
+            j["paused"] = job is not None and job.next_run_time is None
+            j["next_run"] = job.next_run_time.isoformat() if job is not None and job.next_run_time else None
+            d = _job_duration.snapshot(job=job_id)
+            j["duration"] = {"count": d["count"], "sum": round(d["sum"], 4),
+                             "buckets": {("+Inf" if le == float("inf") else str(le)): c for le, c in d["buckets"]}}
+            # 超过 3 个周期没有成功执行（且未暂停）视为数据已陈旧
+            age = now - j["last_success"] if j["last_success"] else None
+            j["last_success_age"] = round(age, 3) if age is not None else None
+            j["stale"] = not j["paused"] and (age is None or age > 3 * j["interval"])
+            if j["running_since"]:
+                j["running_for"] = round(now - j["running_since"], 3)
+            del j["last_scheduled"], j["running_since"]
+        return jobs
+
+
+_monitor = None
+_planner = None
+_detector = None
+
+
+def scheduler_stats():
+    """本进程调度器的观测数据；未运行调度器（已禁用或非 leader）时返回 None。"""
+    if _monitor is None:
+        return None
+    return {"jobs": _monitor.stats(), "planner": _planner.stats() if _planner else None,
+            "anomaly": _detector.stats() if _detector else None}
+
+
+def start_scheduler(supa, hub, snapshot=None, agent_jobs=None, ts_sync=None):
+    global _monitor, _planner, _detector
+    # 快慢任务使用独立线程池：智能体监控等慢任务不会占满 planner 所需的线程
+    scheduler = BackgroundScheduler(executors={
+        "default": ThreadPoolExecutor(int(os.getenv("SCHEDULER_FAST_WORKERS", "4"))),
+        "slow": ThreadPoolExecutor(int(os.getenv("SCHEDULER_SLOW_WORKERS", "2"))),
+    })
+    monitor = JobMonitor()
+    pub = ChangePublisher(hub)
+    detector = AnomalyDetector()
+    series_source = ts_sync or TimeSeriesSync(supa, select="ts,value")
+    # planner 与异常检测共用同一个增量同步：planner 运行时检测任务读到的缓冲区通常已是最新，不再重复拉取
+    planner = PollingPlanner(supa, snapshot or LatestSnapshot(), series=series_source)
+    anomaly_interval = float(os.getenv("ANOMALY_INTERVAL", "5"))
+    _monitor, _planner, _detector = monitor, planner, detector
+
+    # 各推送函数从快照读取最新行，返回本轮是否有通道发生变化
+    def push_dashboard(snap):
+        changed = [
+            pub.publish("dashboard", "dashboard.advanceSpeed", snap.get("advance_speed") or {"ts": None, "value": 1.2}),
+            pub.publish("dashboard", "dashboard.slurryPressure", snap.get("slurry_pressure") or {"ts": None, "value": 1.8}),
+            pub.publish("dashboard", "dashboard.gasConcentration", snap.get("gas_concentration") or {"ts": None, "value": 0.1}),
+        ]
+        if snap.get("summary"):
+            changed.append(pub.publish("dashboard", "dashboard.summary", snap["summary"], delta=True))
+        return any(changed)
+
+    def push_personnel(snap):
+        return any([
+            pub.publish("personnel", "personnel.attendanceTrend", snap.get("attendance_trend") or {"ts": None, "value": 85}),
+            pub.publish("personnel", "personnel.stats", snap.get("personnel_stats") or {"totalOnSite": 48, "attendanceRate": "92%", "violations": 0, "managers": 6}, delta=True),
+        ])
+
+    def push_progress(snap):
+        return any([
+            pub.publish("progress", "progress.dailyRings", snap.get("daily_rings") or {"ts": None, "value": 4}),
+            pub.publish("progress", "progress.stats", snap.get("progress_stats") or {"totalRings": 130, "totalGoal": 240, "dailyRings": 4, "remainingDays": 28, "value": 54}, delta=True),
+        ])
+
+    def push_safety(snap):
+        return any([
+            pub.publish("safety", "safety.settlement.actual", snap.get("settlement_actual") or {"ts": None, "value": 1.0}),
+            pub.publish("safety", "safety.settlement.predict", snap.get("settlement_predict") or {"ts": None, "value": 1.2}),
+            pub.publish("safety", "safety.alarmTrend", snap.get("alarm_trend") or {"ts": None, "value": 1}),
+        ])
+
+    planner.add_topic("dashboard", 2, ["advance_speed", "slurry_pressure", "gas_concentration", "summary"], push_dashboard)
+    planner.add_topic("personnel", 3, ["attendance_trend", "personnel_stats"], push_personnel)
+    planner.add_topic("progress", 3, ["daily_rings", "progress_stats"], push_progress)
+    planner.add_topic("safety", 4, ["settlement_actual", "settlement_predict", "alarm_trend"], push_safety)
+
+    demand_lock = threading.Lock()
+
+    def on_demand(_demand=None):
+        # 订阅/退订在不同请求线程上通知，传入的快照可能乱序到达；
+        # 在锁内重新读取当前订阅数再决定暂停/恢复，最后一次判断总是基于最新状态
+        with demand_lock:
+            job = scheduler.get_job("planner")
+            if job is None:
+                return
+            if planner.set_demand(hub.demand()):
+                if job.next_run_time is None:
+                    job.modify(next_run_time=datetime.now(scheduler.timezone))
+                    print("[Scheduler] resume planner")
+            elif job.next_run_time is not None:
+                job.pause()
+                print("[Scheduler] pause planner (no subscribers)")
 
     # ================= 智能体自主监控任务 =================
     
-    # 上次触发时间，避免过于频繁
-    last_trigger_ts = 0
-    
     def monitor_risk_agent():
-        nonlocal last_trigger_ts
-        import time
-        import random
-        import os
-        
         # 开关控制：默认开启，除非设置 DISABLE_AUTO_AGENT=1
-        if os.getenv("DISABLE_AUTO_AGENT", "0") == "1":
+        if os.getenv("DISABLE_AUTO_AGENT", "0") == "1" or agent_jobs is None:
             return
 
-        # 冷却时间检查 (例如至少间隔 60 秒)
-        now = time.time()
-        if now - last_trigger_ts < 60:
-            return
-
-        # 模拟随机触发 (20% 概率)
-        if random.random() > 0.2:
-            return
+        names = list(detector.streams)
+        # 增量同步各时序流，只有统计检测越限时才提交智能体任务；同一场景的重复触发由队列去重
+        for name, rows in zip(names, series_source.series_many(names, ttl=anomaly_interval / 2)):
+            for alert in detector.feed(name, rows):
+                spec = detector.streams[name]
+                data = {k: v for k, v in alert.items() if k != "stream"}
+                data["metric"] = spec["label"]
+                job, status = agent_jobs.submit(spec["risk_type"], data, spec["location"], auto_triggered=True)
+                if status == "queued":
+                    print(f"[Scheduler] ☁️ 智能体自主监控：{spec['label']} 异常 {alert['rules']}，已提交分析任务 {job.id}")
+                elif status == "rejected":
+                    print(f"[Scheduler] 智能体任务队列已满，丢弃 {spec['label']} 异常")
 
-        print("[Scheduler] ☁️ 智能体自主监控：检测到传感器数据异常，正在介入...")
-        
-        try:
-            from agent import run_agent
-            
-            # 随机生成一种风险场景
-            scenarios = [
-                {
-                    "type": "gas",
-                    "data": {"ch4": round(random.uniform(0.8, 1.5), 2), "trend": "rising"},
-                    "location": "回风管路 A1段"
-                },
-                {
-                    "type": "personnel",
-                    "data": {"distance": round(random.uniform(0.5, 1.5), 1), "confidence": 98.5},
-                    "location": "管片拼装区 B2段"
-                },
-                {
-                    "type": "vehicle",
-                    "data": {"speed": random.randint(15, 25), "proximity": 3.0},
-                    "location": "后配套物流通道"
-                }
-            ]
-            scenario = random.choice(scenarios)
-            
-            # 发送"正在分析"的信号
-            hub.broadcast("agent-status", "agent", {
-                "state": "detecting",
-                "message": f"监测到 {scenario['location']} 异常数据，智能体介入分析中..."
-            })
-            
-            # 运行智能体
-            result = run_agent(scenario["type"], scenario["data"], scenario["location"])
-            
-            # 广播分析结果
-            hub.broadcast("agent-status", "agent", {
-                "state": "completed",
-                "risk_type": scenario["type"],
-                "risk_level": result.get("risk_level"),
-                "plan_count": len(result.get("decision_plan", [])),
-                "auto_triggered": True, # 标记为自动触发
-                "result": {
-                     "analysis": result.get("analysis_result"),
-                     "decision_plan": result.get("decision_plan", []),
-                     "report": result.get("report", "")
-                }
-            })
-            
-            last_trigger_ts = now
-            print(f"[Scheduler] ✅ 智能体自主分析完成: {scenario['type']}")
-            
-        except Exception as e:
-            print(f"[Scheduler] ❌ 智能体监控任务异常: {e}")
-            import traceback
-            traceback.print_exc()
-
-    scheduler.add_job(push_dashboard, "interval", seconds=2, max_instances=1)
-    scheduler.add_job(push_personnel, "interval", seconds=3, max_instances=1)
-    scheduler.add_job(push_progress, "interval", seconds=3, max_instances=1)
-    scheduler.add_job(push_safety, "interval", seconds=4, max_instances=1)
+    scheduler.add_job(monitor.wrap("planner", planner.run_tick, planner.tick), "interval",
+                      seconds=planner.tick, max_instances=1, id="planner")
     
-    # 添加智能体监控任务 (每 10 秒轮询一次)
-    scheduler.add_job(monitor_risk_agent, "interval", seconds=10, max_instances=1)
+    # 添加智能体监控任务 (默认每 5 秒检测一次)
+    scheduler.add_job(monitor.wrap("monitor_risk_agent", monitor_risk_agent, anomaly_interval), "interval",
+                      seconds=anomaly_interval, max_instances=1, id="monitor_risk_agent", executor="slow")
     
+    monitor.attach(scheduler)
     scheduler.start()
+    hub.add_demand_listener(on_demand)
+    on_demand()
@@ -0,0 +1,60 @@
+import threading
+
+# 请求合并（single-flight）：同一 key 的并发调用只执行一次，其余调用等待并共享结果
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.executed = 0
+        self.collapsed = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+        if not leader:
+            with self._stats_lock:
+                self.collapsed += 1
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        with self._stats_lock:
+            self.executed += 1
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        with self._stats_lock:
+            return {"executed": self.executed, "collapsed": self.collapsed, "in_flight": self.in_flight()}
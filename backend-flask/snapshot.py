@@ -0,0 +1,37 @@
+import time
+import threading
+
+# 最新值快照：轮询计划每个周期把各数据源的最新行写入这里，
+# SSE 推送与 REST 接口都从这里读取，同一张表在一个周期内只向上游查询一次
+
+
+class LatestSnapshot:
+    def __init__(self):
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    def put_many(self, rows):
+        now = time.time()
+        with self._lock:
+            for name, row in rows.items():
+                self._rows[name] = (row, now)
+
+    def get(self, name: str, max_age: float = None):
+        """返回数据源的最新行；不存在、为空或早于 max_age 秒时返回 None。"""
+        with self._lock:
+            entry = self._rows.get(name)
+        if entry is None:
+            return None
+        row, at = entry
+        if max_age is not None and time.time() - at > max_age:
+            return None
+        return row
+
+    def view(self):
+        with self._lock:
+            return {name: row for name, (row, _) in self._rows.items()}
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {name: {"age": round(now - at, 3), "empty": row is None} for name, (row, at) in self._rows.items()}
@@ -1,23 +1,446 @@
+import os
+import json
+import time
 import threading
-import queue
+from collections import OrderedDict, deque
+
+import metrics
+from broker import LocalBroker
+
+# 最新值通道：只关心最新状态，订阅者积压时合并为一条（移到队尾，保证帧的事件 ID 单调递增）
+DEFAULT_COALESCE_CHANNELS = "dashboard.summary,personnel.stats,progress.stats"
+
+HEARTBEAT_FRAME = b"event: heartbeat\ndata: ok\n\n"
+
+_dropped = metrics.counter("sse_events_dropped_total", "订阅者缓冲区溢出而丢弃的最旧事件数", ("topic",))
+_lag_disconnects = metrics.counter("sse_lag_disconnects_total", "积压超过 SSE_MAX_LAG 被断开的订阅者数", ("topic",))
+_coalesced = metrics.counter("sse_events_coalesced_total", "被同通道新值合并覆盖的待发送事件数", ("topic",))
+
+
+def parse_list(value):
+    """解析逗号分隔的查询参数（topics、channels），保持顺序并去重。"""
+    if not value:
+        return []
+    return list(dict.fromkeys(v.strip() for v in value.split(",") if v.strip()))
+
+
+def _parse_event_id(value):
+    try:
+        return int(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+class Event:
+    """
+    一次广播的事件：在 broadcast 时序列化一次，得到的 bytes 帧由所有订阅者共享。
+    full 不为空时 payload 是相对上一次的字段级增量（帧中带 "delta": true），
+    需要完整值时（合并积压、新订阅者）通过 keyframe() 取同一 ID 的完整帧，只序列化一次。
+    """
+
+    __slots__ = ("id", "topic", "channel", "frame", "delta", "_full", "_keyframe")
+
+    def __init__(self, event_id: int, topic: str, channel: str, payload, full=None):
+        self.id = event_id
+        self.topic = topic
+        self.channel = channel
+        self.delta = full is not None
+        self._full = full
+        self._keyframe = None
+        body = {"topic": topic, "channel": channel, "payload": payload}
+        if self.delta:
+            body["delta"] = True
+        data = json.dumps(body, ensure_ascii=False)
+        self.frame = f"id: {event_id}\nevent: message\ndata: {data}\n\n".encode("utf-8")
+
+    def keyframe(self) -> "Event":
+        if not self.delta:
+            return self
+        if self._keyframe is None:
+            self._keyframe = Event(self.id, self.topic, self.channel, self._full)
+        return self._keyframe
+
+
+class Subscriber:
+    """
+    单个订阅者的待发送队列：
+    - 最新值通道按 channel 合并，只保留最新一条
+    - 事件通道（risk、agent、时序点等）有界，溢出时丢弃最旧的事件
+    一个订阅者可同时订阅多个 topic；channels 非空时只接收匹配的通道（精确匹配，或以 * 结尾的前缀匹配）
+    """
+
+    def __init__(self, topics, max_events: int = 256, channels=None):
+        self.topics = (topics,) if isinstance(topics, str) else tuple(topics)
+        self.topic = ",".join(self.topics)
+        self.channels = frozenset(c for c in channels or () if not c.endswith("*"))
+        self.prefixes = tuple(c[:-1] for c in channels or () if c.endswith("*"))
+        self.max_events = max_events
+        self.dropped = 0
+        self.coalesced = 0
+        self.delivered = 0
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()
+        self._event_keys = deque()
+        self._seq = 0
+        self.closed = False
+        self.created_at = time.time()
+        # 生成器每次从 yield 恢复（即上一帧已写出）时刷新；长时间不刷新说明连接已卡死
+        self.last_seen = self.created_at
+        self.rate = 0.0
+        self._rate_at = self.created_at
+        self._rate_delivered = 0
+        # 异步消费者（asgi.py）注册的唤醒回调，队列由空变为非空或关闭时在生产者线程中调用
+        self.waker = None
+
+    def accepts(self, channel: str) -> bool:
+        if not self.channels and not self.prefixes:
+            return True
+        return channel in self.channels or channel.startswith(self.prefixes)
+
+    def put(self, item: Event, coalesce: bool = False):
+        """入队一条事件；返回 "coalesced" / "dropped" 表示发生了合并或丢弃，否则返回 None。"""
+        outcome = None
+        now = time.time()
+        with self._cond:
+            was_empty = not self._pending
+            if coalesce:
+                key = ("c", item.channel)
+                prev = self._pending.get(key)
+                if prev is not None:
+                    self.coalesced += 1
+                    outcome = "coalesced"
+                    self._pending.move_to_end(key)
+                    # 被覆盖的可能是尚未发出的增量，合并后必须发完整值；积压时间从被覆盖的那条算起
+                    item = item.keyframe()
+                    now = prev[1]
+                self._pending[key] = (item, now)
+            else:
+                self._seq += 1
+                key = ("e", self._seq)
+                self._pending[key] = (item, now)
+                self._event_keys.append(key)
+                if len(self._event_keys) > self.max_events:
+                    del self._pending[self._event_keys.popleft()]
+                    self.dropped += 1
+                    outcome = "dropped"
+            self._cond.notify()
+        if was_empty:
+            self._wake()
+        return outcome
+
+    def get(self, timeout=None):
+        """取出下一条待发送项；超时或已关闭返回 None。"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._pending or self.closed, timeout) or self.closed:
+                return None
+            key, (item, _) = self._pending.popitem(last=False)
+            if key[0] == "e":
+                self._event_keys.popleft()
+            self.delivered += 1
+            return item
+
+    def drain(self, max_items: int = 64):
+        """非阻塞地取出至多 max_items 条待发送项。"""
+        with self._cond:
+            out = []
+            while self._pending and len(out) < max_items and not self.closed:
+                key, (item, _) = self._pending.popitem(last=False)
+                if key[0] == "e":
+                    self._event_keys.popleft()
+                out.append(item)
+            self.delivered += len(out)
+            return out
+
+    def touch(self):
+        self.last_seen = time.time()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._pending.clear()
+            self._event_keys.clear()
+            self._cond.notify_all()
+        self._wake()
+
+    def _wake(self):
+        waker = self.waker
+        if waker is not None:
+            try:
+                waker()
+            except RuntimeError:
+                # 事件循环已关闭
+                self.waker = None
+
+    def qsize(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def lag(self) -> float:
+        """最早一条未送达事件已等待的秒数，队列为空时为 0。"""
+        with self._cond:
+            if not self._pending:
+                return 0.0
+            return max(0.0, time.time() - min(t for _, t in self._pending.values()))
+
+    def sample_rate(self) -> float:
+        """按两次采样之间送达的条数计算投递速率（条/秒），由 hub 的巡检线程定期调用。"""
+        now = time.time()
+        delivered = self.delivered
+        elapsed = now - self._rate_at
+        if elapsed > 0:
+            self.rate = (delivered - self._rate_delivered) / elapsed
+        self._rate_at, self._rate_delivered = now, delivered
+        return self.rate
+
+    def stats(self):
+        lag = self.lag()
+        with self._cond:
+            return {
+                "topic": self.topic,
+                "age": round(time.time() - self.created_at, 1),
+                "idle": round(time.time() - self.last_seen, 1),
+                "depth": len(self._pending),
+                "lag": round(lag, 3),
+                "rate": round(self.rate, 2),
+                "delivered": self.delivered,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+            }
+
 
 class SseHub:
-    def __init__(self):
+    """
+    订阅生命周期：stream() 生成器结束（客户端断开、写入失败）时自动退订；
+    心跳帧定期写出以尽早发现断开的连接；后台线程回收长时间未写出任何帧的订阅者。
+
+    断线续传：事件 ID 全局单调递增（以毫秒时间戳为起点，进程重启后仍大于旧 ID），
+    每个 topic 保留最近 SSE_REPLAY_SIZE 条事件，重连时补发 Last-Event-ID 之后的事件。
+
+    慢消费者：最早一条未送达事件的积压时间超过 SSE_MAX_LAG 秒时断开该订阅者，
+    客户端重连后经回放缓冲区与最新值快照追平，避免单个客户端长期占用内存。
+    """
+
+    def __init__(self, coalesce_channels=None, max_events: int = None,
+                 heartbeat: float = None, idle_timeout: float = None, replay_size: int = None, broker=None,
+                 max_lag: float = None):
         self._topics = {}
         self._lock = threading.Lock()
+        self.replay_size = int(os.getenv("SSE_REPLAY_SIZE", "256")) if replay_size is None else replay_size
+        self._replay = {}
+        # 最新值通道的当前值：(topic, channel) -> Event，新订阅者先收到完整快照再接收增量
+        self._state = {}
+        self._next_id = int(time.time() * 1000)
+        self.replayed = 0
+        self.heartbeat = float(os.getenv("SSE_HEARTBEAT", "15")) if heartbeat is None else heartbeat
+        self.idle_timeout = float(os.getenv("SSE_IDLE_TIMEOUT", "90")) if idle_timeout is None else idle_timeout
+        self.max_lag = float(os.getenv("SSE_MAX_LAG", "30")) if max_lag is None else max_lag
+        self.reaped = 0
+        self.lagged = 0
+        self._reaper = None
+        metrics.gauge("sse_subscribers", "各 topic 当前订阅者数", self.subscriber_counts, ("topic",))
+        metrics.gauge("sse_max_lag_seconds", "各 topic 订阅者中最大的未送达积压时间",
+                      lambda: {t: v["maxLag"] for t, v in self.topic_stats().items()}, ("topic",))
+        self._demand_listeners = []
+        self._delivery_listeners = {}
+        self._presence_lock = threading.Lock()
+        self.broker = broker or LocalBroker()
+        self.broker.start(self._deliver, on_presence=self._notify_demand)
+        if coalesce_channels is None:
+            coalesce_channels = os.getenv("SSE_COALESCE_CHANNELS", DEFAULT_COALESCE_CHANNELS).split(",")
+        self.coalesce_channels = {c.strip() for c in coalesce_channels if c.strip()}
+        self.max_events = max_events or int(os.getenv("SSE_MAX_EVENTS", "256"))
 
-    def subscribe(self, topic: str):
-        q = queue.Queue(maxsize=1024)
+    def subscribe(self, topics, last_event_id=None, channels=None):
+        """
+        订阅一个或多个 topic（多路复用时共用一个队列与一条连接），channels 为服务端通道过滤；
+        给出 last_event_id 时先把回放缓冲区中更新的事件按 ID 顺序放入队列。
+        """
+        q = Subscriber(topics, self.max_events, channels)
+        last = _parse_event_id(last_event_id)
         with self._lock:
-            self._topics.setdefault(topic, set()).add(q)
+            for (t, channel), item in self._state.items():
+                if t in q.topics and q.accepts(channel):
+                    q.put(item.keyframe(), True)
+            # 与 broadcast 在同一把锁下登记，保证每条事件要么在回放里、要么实时投递，不重不漏
+            if last is not None:
+                missed = [i for t in q.topics for i in self._replay.get(t, ()) if i.id > last and q.accepts(i.channel)]
+                if len(q.topics) > 1:
+                    missed.sort(key=lambda i: i.id)
+                for item in missed:
+                    q.put(item, item.delta or item.channel in self.coalesce_channels)
+                self.replayed += len(missed)
+            for t in q.topics:
+                self._topics.setdefault(t, set()).add(q)
+            self._ensure_reaper()
+        self._presence_changed()
         return q
 
-    def broadcast(self, topic: str, channel: str, payload):
-        item = {"channel": channel, "payload": payload}
+    def unsubscribe(self, q: Subscriber):
+        removed = False
         with self._lock:
-            for q in list(self._topics.get(topic, set())):
-                try:
-                    q.put_nowait(item)
-                except Exception:
-                    pass
+            for t in q.topics:
+                subs = self._topics.get(t)
+                if subs is not None and q in subs:
+                    subs.discard(q)
+                    removed = True
+                    if not subs:
+                        del self._topics[t]
+        q.close()
+        if removed:
+            self._presence_changed()
+
+    def stream(self, q: Subscriber):
+        """SSE 帧生成器：空闲时按心跳间隔写出 heartbeat 帧，生成器关闭时退订。"""
+        try:
+            yield HEARTBEAT_FRAME
+            while not q.closed:
+                q.touch()
+                item = q.get(timeout=self.heartbeat)
+                if item is None:
+                    if q.closed:
+                        break
+                    yield HEARTBEAT_FRAME
+                    continue
+                yield item.frame
+        finally:
+            self.unsubscribe(q)
+            print("[sse] unsubscribe topic=", q.topic, "delivered=", q.delivered)
+
+    def _ensure_reaper(self):
+        if self._reaper is None and (self.idle_timeout > 0 or self.max_lag > 0):
+            self._reaper = threading.Thread(target=self._reap_loop, name="sse-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        limits = [v for v in (self.heartbeat, self.idle_timeout, self.max_lag / 2) if v > 0]
+        while True:
+            time.sleep(max(1.0, min(limits)))
+            self.reap()
+
+    def reap(self) -> int:
+        """
+        巡检所有订阅者：更新投递速率；关闭超过 idle_timeout 未写出任何帧的订阅者（连接卡死），
+        以及积压超过 max_lag 的慢消费者。
+        """
+        cutoff = time.time() - self.idle_timeout
+        with self._lock:
+            subs = {q for qs in self._topics.values() for q in qs}
+        closed = 0
+        for q in subs:
+            q.sample_rate()
+            if self.idle_timeout > 0 and q.last_seen < cutoff:
+                reason = "idle"
+                self.reaped += 1
+            elif self.max_lag > 0 and q.lag() > self.max_lag:
+                reason = "lag"
+                self.lagged += 1
+                _lag_disconnects.inc(topic=q.topic)
+            else:
+                continue
+            self.unsubscribe(q)
+            closed += 1
+            print(f"[sse] disconnect {reason} subscriber topic=", q.topic)
+        return closed
+
+    def demand(self):
+        """各 topic 的订阅者总数：本进程 + 经 broker 汇总的其他 worker（leader 上完整）。"""
+        counts = self.subscriber_counts()
+        for t, n in self.broker.remote_counts().items():
+            counts[t] = counts.get(t, 0) + n
+        return counts
+
+    def add_delivery_listener(self, topic: str, fn):
+        """本进程收到 topic 的每条消息（含经 broker 转发的其他 worker 消息）时回调 fn(channel, payload)。"""
+        self._delivery_listeners.setdefault(topic, []).append(fn)
 
+    def add_demand_listener(self, fn):
+        """订阅数变化时回调 fn(demand)。"""
+        self._demand_listeners.append(fn)
+
+    def _presence_changed(self):
+        # 串行化上报：锁内读取订阅数，避免并发的订阅/退订把旧快照最后发给 leader
+        with self._presence_lock:
+            self.broker.report_presence(self.subscriber_counts())
+        self._notify_demand()
+
+    def _notify_demand(self):
+        if not self._demand_listeners:
+            return
+        demand = self.demand()
+        for fn in list(self._demand_listeners):
+            try:
+                fn(demand)
+            except Exception as e:
+                print("[sse] demand listener error:", e)
+
+    def subscriber_counts(self):
+        with self._lock:
+            return {t: len(qs) for t, qs in self._topics.items()}
+
+    def broadcast(self, topic: str, channel: str, payload, full=None):
+        """
+        经 broker 发布；多进程部署时由 broker 转发到每个 worker 后再本地投递。
+        full 不为空时 payload 为增量，full 为应用增量后的完整值。
+        """
+        msg = {"topic": topic, "channel": channel, "payload": payload}
+        if full is not None:
+            msg["full"] = full
+        self.broker.publish(msg)
+
+    def _deliver(self, msg):
+        topic, channel = msg["topic"], msg["channel"]
+        with self._lock:
+            # 由 broker 统一分配 ID 时原样沿用，保证各 worker 的事件 ID 一致；没有时本地递增
+            if msg.get("id"):
+                self._next_id = msg["id"]
+            else:
+                self._next_id += 1
+            item = Event(self._next_id, topic, channel, msg["payload"], msg.get("full"))
+            # 增量帧只对最新值通道有意义，按最新值通道处理
+            coalesce = item.delta or channel in self.coalesce_channels
+            if coalesce:
+                self._state[(topic, channel)] = item
+            if self.replay_size > 0:
+                ring = self._replay.get(topic)
+                if ring is None:
+                    ring = self._replay[topic] = deque(maxlen=self.replay_size)
+                ring.append(item)
+            subs = list(self._topics.get(topic, set()))
+        for q in subs:
+            if not q.accepts(channel):
+                continue
+            outcome = q.put(item, coalesce)
+            if outcome == "dropped":
+                _dropped.inc(topic=topic)
+            elif outcome == "coalesced":
+                _coalesced.inc(topic=topic)
+        for fn in self._delivery_listeners.get(topic, ()):
+            try:
+                fn(channel, msg.get("full") or msg["payload"])
+            except Exception as e:
+                print("[sse] delivery listener error:", e)
+
+    def stats(self):
+        with self._lock:
+            subs = {q for qs in self._topics.values() for q in qs}
+        return {"topics": self.subscriber_counts(), "subscribers": len(subs), "reaped": self.reaped, "lagged": self.lagged,
+                "replayed": self.replayed, "lastEventId": self._next_id, "demand": self.demand(), "broker": self.broker.stats()}
+
+    def topic_stats(self):
+        """按 topic 汇总：订阅者数、积压条数、最大积压时间、投递速率与丢弃/合并次数。"""
+        out = {}
+        for st in self.subscriber_stats():
+            for t in st["topic"].split(","):
+                agg = out.setdefault(t, {"subscribers": 0, "depth": 0, "maxLag": 0.0, "rate": 0.0, "dropped": 0, "coalesced": 0})
+                agg["subscribers"] += 1
+                agg["depth"] += st["depth"]
+                agg["maxLag"] = max(agg["maxLag"], st["lag"])
+                agg["rate"] = round(agg["rate"] + st["rate"], 2)
+                agg["dropped"] += st["dropped"]
+                agg["coalesced"] += st["coalesced"]
+        return out
+
+    def subscriber_stats(self):
+        with self._lock:
+            subs = {q for qs in self._topics.values() for q in qs}
+        return [q.stats() for q in subs]
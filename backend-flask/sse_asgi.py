@@ -0,0 +1,118 @@
+import asyncio
+import threading
+from urllib.parse import parse_qs
+
+from sse import HEARTBEAT_FRAME, parse_list
+
+# SSE 长连接的 ASGI 服务：由事件循环直接服务（每个客户端只占一个协程与一个订阅队列，不占线程），
+# 订阅队列通过 waker 回调（call_soon_threadsafe）唤醒协程；其余请求交给 fallback 应用
+
+STREAM_PATH = "/api/stream"
+STREAM_PREFIX = "/api/stream/"
+
+
+def _header(scope, name: bytes):
+    for k, v in scope.get("headers") or ():
+        if k.lower() == name:
+            return v.decode("latin-1")
+    return None
+
+
+class SseAsgiApp:
+    def __init__(self, hub, fallback, batch: int = 64):
+        self.hub = hub
+        self.fallback = fallback
+        self.batch = batch
+        # 生产者线程一次广播会唤醒大量协程：先收集到 _ready，每批只向事件循环投递一次回调
+        self._ready = []
+        self._ready_lock = threading.Lock()
+        self._loop = None
+
+    def _notify(self, wake):
+        with self._ready_lock:
+            self._ready.append(wake)
+            if len(self._ready) > 1:
+                return
+        self._loop.call_soon_threadsafe(self._flush)
+
+    def _flush(self):
+        with self._ready_lock:
+            ready, self._ready = self._ready, []
+        for wake in ready:
+            wake.set()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        path = scope.get("path", "")
+        if scope["type"] == "http" and scope.get("method") == "GET" and (path == STREAM_PATH or path.startswith(STREAM_PREFIX)):
+            query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+            last_event_id = _header(scope, b"last-event-id") or (query.get("lastEventId") or [None])[0]
+            if path == STREAM_PATH:
+                topics = parse_list((query.get("topics") or [""])[0])
+                if not topics:
+                    return await self._bad_request(send, b'{"error":"topics required"}')
+                channels = parse_list((query.get("channels") or [""])[0])
+            else:
+                topics, channels = path[len(STREAM_PREFIX):], None
+            q = self.hub.subscribe(topics, last_event_id=last_event_id, channels=channels)
+            return await self.stream(q, receive, send)
+        return await self.fallback(scope, receive, send)
+
+    async def _bad_request(self, send, body: bytes):
+        await send({"type": "http.response.start", "status": 400, "headers": [
+            (b"content-type", b"application/json"), (b"access-control-allow-origin", b"*")]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def stream(self, q, receive, send):
+        self._loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        q.waker = lambda: self._notify(wake)
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            q.close()
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                    (b"access-control-allow-origin", b"*"),
+                ],
+            })
+            await send({"type": "http.response.body", "body": HEARTBEAT_FRAME, "more_body": True})
+            while not q.closed:
+                q.touch()
+                wake.clear()
+                items = q.drain(self.batch)
+                if items:
+                    # 积压的多条帧合并为一次写出
+                    await send({"type": "http.response.body", "body": b"".join(i.frame for i in items), "more_body": True})
+                    continue
+                # 用定时回调代替 wait_for，避免每次等待都创建新任务
+                timer = self._loop.call_later(self.hub.heartbeat, wake.set)
+                await wake.wait()
+                timer.cancel()
+                if not q.qsize() and not q.closed:
+                    await send({"type": "http.response.body", "body": HEARTBEAT_FRAME, "more_body": True})
+        except OSError:
+            pass
+        finally:
+            watcher.cancel()
+            q.waker = None
+            self.hub.unsubscribe(q)
+
@@ -1,15 +1,68 @@
 import os
+import time
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, wait
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import cache as _cache
+import metrics
+from singleflight import SingleFlight
+from circuit import CircuitBreaker, CircuitOpenError
+
+_M_CACHE = metrics.counter("supabase_cache_requests_total", "Cached reads by outcome (fresh, stale = served while revalidating, miss)", ("table", "result"))
+_M_STALE = metrics.counter("supabase_stale_served_total", "Last-known-good data served after an upstream failure", ("table",))
+_M_ERRORS = metrics.counter("supabase_upstream_errors_total", "Upstream failures by kind (exception, http, decode)", ("table", "kind"))
+_M_REQUESTS = metrics.counter("supabase_upstream_requests_total", "Upstream HTTP requests by status", ("table", "method", "status"))
+_M_LATENCY = metrics.histogram("supabase_upstream_latency_seconds", "Upstream HTTP latency including retries", ("table", "method"))
+_M_CIRCUIT_REJECTED = metrics.counter("supabase_circuit_rejected_total", "Requests failed fast while the circuit was open", ("host", "table"))
+
+# 每个上游主机一个熔断器，同一主机的多个客户端共享状态
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(host: str) -> CircuitBreaker:
+    with _breakers_lock:
+        b = _breakers.get(host)
+        if b is None:
+            b = _breakers[host] = CircuitBreaker(host)
+        return b
+
+
+def breaker_stats():
+    with _breakers_lock:
+        items = list(_breakers.items())
+    return {host: b.stats() for host, b in items}
+
+
+_STATE_CODES = {"closed": 0, "half_open": 1, "open": 2}
+metrics.gauge("supabase_circuit_state", "Circuit breaker state per host (0 closed, 1 half-open, 2 open)",
+              lambda: {h: _STATE_CODES[st["state"]] for h, st in breaker_stats().items()}, labelnames=("host",))
 
 class SupabaseClient:
     def __init__(self, url: str, service_key: str):
-        self.url = url.rstrip("/")
-        self.key = service_key
+        self.url = (url or "").rstrip("/")
+        self.key = service_key or ""
         self.timeout = float(os.getenv("SUPABASE_HTTP_TIMEOUT", "2.5"))
+        self.write_timeout = float(os.getenv("SUPABASE_WRITE_TIMEOUT", "5"))
         self.session = self._make_session()
+        self.host = urlparse(self.url).netloc
+        self.breaker = get_breaker(self.host)
+        self._flight = SingleFlight()
+        # stale-while-revalidate：默认关闭，stale_ttl>0 时过期但未超过 stale_ttl 的缓存立即返回并后台刷新
+        self.stale_ttl = float(os.getenv("SUPABASE_STALE_TTL", "0"))
+        self._refresh_workers = int(os.getenv("SUPABASE_REFRESH_WORKERS", "2"))
+        self._refresh_pool = None
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+        # 多表并发查询的线程池，与 session 共享连接池
+        self.fanout_timeout = float(os.getenv("SUPABASE_FANOUT_TIMEOUT", "5"))
+        self._fanout_workers = int(os.getenv("SUPABASE_FANOUT_WORKERS", "8"))
+        self._fanout_pool = None
+        # 被 PostgREST 拒绝（HTTP 400，通常是列不存在）的 (table, select) 投影
+        self._rejected = set()
 
     def _make_session(self):
         s = requests.Session()
@@ -19,13 +72,18 @@ class SupabaseClient:
             read=3,
             backoff_factor=0.3,
             status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=frozenset(["GET"])
+            # POST 非幂等，不自动重试
+            allowed_methods=frozenset(["GET", "PATCH"])
         )
         adapter = HTTPAdapter(max_retries=retries, pool_connections=50, pool_maxsize=50)
         s.mount("https://", adapter)
         s.mount("http://", adapter)
         return s
 
+    @property
+    def configured(self) -> bool:
+        return bool(self.url and self.key)
+
     def _headers(self):
         return {
             "apikey": self.key,
@@ -33,62 +91,289 @@ class SupabaseClient:
             "Content-Type": "application/json"
         }
 
-    def _cache_key(self, table: str, select: str, order: str, limit: int):
-        return "|".join([table or "", select or "", order or "", str(limit or "")])
+    def _cache_key(self, table: str, select: str, order: str, limit: int, filters: dict = None):
+        parts = [table or "", select or "", order or "", str(limit or "")]
+        if filters:
+            parts.append("&".join(f"{k}={v}" for k, v in sorted(filters.items())))
+        return "|".join(parts)
+
+    def _send(self, method: str, table: str, **kwargs):
+        """
+        发起 HTTP 请求并记录上游延迟、状态码与错误；网络异常原样抛出。
+        熔断器打开时直接抛出 CircuitOpenError，由调用方回退到 last-known-good 缓存。
+        """
+        if not self.breaker.allow():
+            _M_CIRCUIT_REJECTED.inc(host=self.host, table=table)
+            raise CircuitOpenError(self.host)
+        t0 = time.perf_counter()
+        try:
+            r = self.session.request(method, f"{self.url}/rest/v1/{table}", **kwargs)
+        except Exception:
+            _M_ERRORS.inc(table=table, kind="exception")
+            self.breaker.record_failure()
+            raise
+        finally:
+            _M_LATENCY.observe(time.perf_counter() - t0, table=table, method=method)
+        _M_REQUESTS.inc(table=table, method=method, status=r.status_code)
+        if r.status_code >= 400:
+            _M_ERRORS.inc(table=table, kind="http")
+        # 5xx 与 429 视为上游故障；其余 4xx 是请求本身的问题，不影响熔断
+        if r.status_code >= 500 or r.status_code == 429:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return r
+
+    def _read(self, table: str, key: str, ttl, stale_ttl, fetch):
+        if ttl:
+            # 新鲜度判断经 cache.get 计入 cache_lookups_total；过期条目再以不计数的 get_entry 判断能否 stale 返回
+            value = _cache.get(key, ttl)
+            if value is not None:
+                _M_CACHE.inc(table=table, result="fresh")
+                return value
+            stale_ttl = self.stale_ttl if stale_ttl is None else stale_ttl
+            entry = _cache.get_entry(key) if stale_ttl else None
+            if entry is not None and time.time() - entry[1] <= stale_ttl:
+                _M_CACHE.inc(table=table, result="stale")
+                self._refresh_async(key, fetch)
+                return entry[0]
+            _M_CACHE.inc(table=table, result="miss")
+        return self._flight.do(key, fetch)
+
+    def _refresh_async(self, key: str, fetch):
+        with self._refresh_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            if self._refresh_pool is None:
+                self._refresh_pool = ThreadPoolExecutor(max_workers=self._refresh_workers, thread_name_prefix="supa-refresh")
+        def run():
+            try:
+                self._flight.do(key, fetch)
+            except Exception:
+                pass
+            finally:
+                with self._refresh_lock:
+                    self._refreshing.discard(key)
+        try:
+            self._refresh_pool.submit(run)
+        except RuntimeError:
+            with self._refresh_lock:
+                self._refreshing.discard(key)
 
-    def get_list(self, table: str, select: str = "*", order: str = "ts.desc", limit: int = 300, ttl=None):
+    def get_list(self, table: str, select: str = "*", order: str = "ts.desc", limit: int = 300, ttl=None, stale_ttl=None,
+                 filters: dict = None, cache: bool = True):
+        """
+        ttl 为新鲜期；stale_ttl 为可接受的最大缓存年龄（秒），介于两者之间时先返回旧值再后台刷新。
+        filters 为 PostgREST 过滤参数，如 {"ts": "gt.2025-01-01T00:00:00Z"}；cache=False 时不读写缓存。
+        """
         if not self.url or not self.key:
             return []
         params = {"select": select, "limit": str(limit)}
         if order:
             params["order"] = order
-        key = self._cache_key(table, select, order, limit)
-        cached = _cache.get(key, ttl) if ttl else None
+        if filters:
+            params.update(filters)
+        key = self._cache_key(table, select, order, limit, filters)
+        if not cache:
+            return self._flight.do(key, lambda: self._fetch_list(table, params, key, store=False))
+        return self._read(table, key, ttl, stale_ttl, lambda: self._fetch_list(table, params, key, ttl))
+
+    def _fetch_list(self, table: str, params: dict, key: str, ttl=None, store: bool = True):
+        # 排队进入 flight 期间可能已有其他调用刷新了缓存
+        cached = _cache.get(key, ttl, record=False) if ttl and store else None
         if cached is not None:
             return cached
         try:
-            r = self.session.get(
-                f"{self.url}/rest/v1/{table}",
-                headers=self._headers(),
-                params=params,
-                timeout=self.timeout
-            )
+            r = self._send("GET", table, headers=self._headers(), params=params, timeout=self.timeout)
+            if r.status_code == 400 and params.get("select", "*") != "*":
+                print(f"[SupabaseClient] projection rejected on {table}: select={params['select']} {r.text[:200]}")
+                self._rejected.add((table, params["select"]))
             if r.status_code != 200:
-                last = _cache.get_last(key)
-                return last if last is not None else []
+                return self._fallback(table, key, store)
             try:
                 data = r.json()
-                _cache.set(key, data)
+                if store:
+                    _cache.set(key, data, size=len(r.content))
                 return data
             except Exception:
-                last = _cache.get_last(key)
-                return last if last is not None else []
+                _M_ERRORS.inc(table=table, kind="decode")
+                return self._fallback(table, key, store)
         except Exception:
-            last = _cache.get_last(key)
-            return last if last is not None else []
+            return self._fallback(table, key, store)
+
+    def _fallback(self, table: str, key: str, store: bool = True, default=None):
+        last = _cache.get_last(key) if store else None
+        if last is not None:
+            _M_STALE.inc(table=table)
+            return last
+        return [] if default is None else default
+
+    def projection_rejected(self, table: str, select: str) -> bool:
+        return (table, select) in self._rejected
 
-    def count(self, table: str, ttl=None):
+    COUNT_MODES = ("exact", "planned", "estimated")
+
+    def _count_key(self, table: str, mode: str = "exact", filters: dict = None):
+        key = f"count:{table}" if mode == "exact" else f"count:{table}:{mode}"
+        if filters:
+            key += "|" + "&".join(f"{k}={v}" for k, v in sorted(filters.items()))
+        return key
+
+    def count(self, table: str, ttl=None, stale_ttl=None, mode: str = "exact", filters: dict = None,
+              strict: bool = False):
+        """
+        mode: exact 全表精确计数（大表上为全表扫描）；planned 取查询计划估计值，O(1)；
+        estimated 小表精确、超过 PostgREST max-rows 后退化为 planned。
+        strict=True 时请求失败且没有 last-known-good 值返回 None，而不是 0。
+        """
+        if mode not in self.COUNT_MODES:
+            raise ValueError(f"unknown count mode: {mode}")
         if not self.url or not self.key:
             return 0
-        params = {"select": "id", "limit": "1"}
-        key = f"count:{table}"
-        cached = _cache.get(key, ttl) if ttl else None
+        key = self._count_key(table, mode, filters)
+        return self._read(table, key, ttl, stale_ttl, lambda: self._fetch_count(table, key, ttl, mode, filters, strict))
+
+    def _fetch_count(self, table: str, key: str, ttl=None, mode: str = "exact", filters: dict = None,
+                     strict: bool = False):
+        default = None if strict else 0
+        cached = _cache.get(key, ttl, record=False) if ttl else None
         if cached is not None:
             return cached
+        params = {"select": "id", "limit": "1"}
+        if filters:
+            params.update(filters)
         try:
-            r = self.session.get(
-                f"{self.url}/rest/v1/{table}",
-                headers={**self._headers(), "Prefer": "count=exact"},
-                params=params,
-                timeout=self.timeout
-            )
+            r = self._send("GET", table, headers={**self._headers(), "Prefer": f"count={mode}"}, params=params, timeout=self.timeout)
             try:
                 value = int(r.headers.get("Content-Range", "0/0").split("/")[-1])
                 _cache.set(key, value)
                 return value
             except Exception:
-                last = _cache.get_last(key)
-                return last if last is not None else 0
+                _M_ERRORS.inc(table=table, kind="decode")
+                return self._count_fallback(table, key, default)
+        except Exception:
+            return self._count_fallback(table, key, default)
+
+    def _count_fallback(self, table: str, key: str, default):
+        last = _cache.get_last(key)
+        if last is not None:
+            _M_STALE.inc(table=table)
+            return last
+        return default
+
+    # ================= 写操作 =================
+
+    def request(self, method: str, table: str, params: dict = None, json=None, prefer: str = None, timeout=None):
+        """直接发起 PostgREST 请求，复用连接池与重试策略；失败返回 None。"""
+        if not self.configured:
+            return None
+        headers = self._headers()
+        if prefer:
+            headers["Prefer"] = prefer
+        try:
+            return self._send(method, table, headers=headers, params=params, json=json, timeout=timeout or self.write_timeout)
+        except CircuitOpenError:
+            return None
+        except Exception as e:
+            print(f"[SupabaseClient] {method} {table} error: {e}")
+            return None
+
+    def insert(self, table: str, records, returning: bool = True):
+        """插入单条 (dict) 或批量 (list) 记录，returning=True 时返回写入后的行列表，失败返回 None。"""
+        r = self.request("POST", table, json=records, prefer="return=representation" if returning else "return=minimal")
+        if r is None or r.status_code not in (200, 201, 204):
+            if r is not None:
+                print(f"[SupabaseClient] insert {table} HTTP {r.status_code}: {r.text[:200]}")
+            return None
+        if not returning:
+            return []
+        try:
+            data = r.json()
         except Exception:
-            last = _cache.get_last(key)
-            return last if last is not None else 0
+            return []
+        return data if isinstance(data, list) else [data]
+
+    def update(self, table: str, filters: dict, updates: dict) -> bool:
+        """按 PostgREST 过滤条件更新记录，如 update("t", {"id": "eq.1"}, {...})。"""
+        r = self.request("PATCH", table, params=filters, json=updates)
+        return r is not None and r.status_code in (200, 204)
+
+    def run_concurrently(self, fns, timeout=None, defaults=None):
+        """
+        在有界线程池上并发执行无参函数，按顺序返回结果。
+        超时或抛异常的项返回 defaults 中对应的值（可为可调用对象，按需计算）。
+        """
+        timeout = self.fanout_timeout if timeout is None else timeout
+        defaults = defaults or [None] * len(fns)
+        with self._refresh_lock:
+            if self._fanout_pool is None:
+                self._fanout_pool = ThreadPoolExecutor(max_workers=self._fanout_workers, thread_name_prefix="supa-fanout")
+        futures = [self._fanout_pool.submit(fn) for fn in fns]
+        wait(futures, timeout=timeout)
+        results = []
+        for f, d in zip(futures, defaults):
+            if f.done() and f.exception() is None:
+                results.append(f.result())
+            else:
+                results.append(d() if callable(d) else d)
+        return results
+
+    def get_many(self, queries, timeout=None):
+        """
+        并发执行多条独立查询，总耗时约等于最慢的一条。
+        queries 中每项为 get_list 的关键字参数字典；含 "op": "count" 时执行 count（可带 mode）；
+        也可以是 (无参函数, 默认值) 二元组，与其他查询同批并发执行（如本地增量同步的计数）。
+        单条失败或超时时返回该查询的 last-known-good 缓存或空值，不影响其他查询。
+        """
+        fns, defaults = [], []
+        for q in queries:
+            if isinstance(q, tuple):
+                fns.append(q[0])
+                defaults.append(q[1])
+                continue
+            q = dict(q)
+            op = q.pop("op", "list")
+            if op == "count":
+                key = self._count_key(q.get("table"), q.get("mode", "exact"), q.get("filters"))
+                fns.append(lambda q=q: self.count(**q))
+                defaults.append(lambda key=key, t=q.get("table"): self._fallback(t, key, default=0))
+            else:
+                key = self._cache_key(q.get("table"), q.get("select", "*"), q.get("order", "ts.desc"), q.get("limit", 300), q.get("filters"))
+                fns.append(lambda q=q: self.get_list(**q))
+                defaults.append(lambda key=key, t=q.get("table"): self._fallback(t, key))
+        return self.run_concurrently(fns, timeout=timeout, defaults=defaults)
+
+    def stats(self):
+        with self._refresh_lock:
+            refreshing = len(self._refreshing)
+        return {"cache": _cache.stats(), "singleflight": self._flight.stats(), "refreshing": refreshing,
+                "circuit": self.breaker.stats()}
+
+
+# ================= 进程级客户端注册表 =================
+# 同一 (url, key) 在进程内只创建一个客户端，共享连接池、缓存、single-flight 与线程池
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(url: str = None, service_key: str = None) -> SupabaseClient:
+    url = os.getenv("SUPABASE_URL", "") if url is None else url
+    service_key = os.getenv("SUPABASE_SERVICE_KEY", "") if service_key is None else service_key
+    k = ((url or "").rstrip("/"), service_key or "")
+    with _clients_lock:
+        client = _clients.get(k)
+        if client is None:
+            client = _clients[k] = SupabaseClient(url, service_key)
+        return client
+
+
+def _flight_totals(field):
+    with _clients_lock:
+        clients = list(_clients.values())
+    return sum(c._flight.stats()[field] for c in clients)
+
+
+metrics.gauge("supabase_singleflight_collapsed_total", "Calls that joined an in-flight identical request", lambda: _flight_totals("collapsed"), kind="counter")
+metrics.gauge("supabase_singleflight_executed_total", "Requests actually executed by single-flight leaders", lambda: _flight_totals("executed"), kind="counter")
@@ -0,0 +1,115 @@
+import time
+import threading
+
+from agent_jobs import AgentJobQueue, QUEUED, COMPLETED, DROPPED
+
+# 智能体任务队列：去重、限深挤出与跨 worker 的任务状态副本（runner 用桩函数，不依赖 LangGraph）
+#   python test_agent_jobs.py
+
+
+class _Hub:
+    def __init__(self):
+        self.sent = []
+        self.listeners = []
+
+    def broadcast(self, topic, channel, payload):
+        self.sent.append(payload)
+        for fn in self.listeners:
+            fn(channel, payload)
+
+    def add_delivery_listener(self, topic, fn):
+        self.listeners.append(fn)
+
+
+def _wait(cond, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if cond():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def _gated_runner():
+    gate = threading.Event()
+    order = []
+
+    def run(job, on_step):
+        gate.wait(5)
+        order.append(job.risk_type)
+        on_step("analyze", {"risk_level": "low"})
+        return {"risk_level": "low", "analysis_result": "ok"}
+    return gate, order, run
+
+
+def test_dedup():
+    gate, _, runner = _gated_runner()
+    q = AgentJobQueue(_Hub(), runner=runner, workers=1, max_depth=5, dedup_window=60)
+    job, status = q.submit("gas", {"value": 1}, "A1", auto_triggered=True)
+    assert status == "queued"
+    # 同一 (风险类型, 位置) 排队/运行中时合并到已有任务
+    assert q.submit("gas", {"value": 2}, "A1", auto_triggered=True) == (job, "duplicate")
+    assert q.submit("gas", {"value": 2}, "A2")[1] == "queued"
+    # 接口提交：只合并传感器数据相同且仍在进行中的任务
+    assert q.submit("gas", {"value": 1}, "A1", dedup=False) == (job, "duplicate")
+    other, status = q.submit("gas", {"value": 3}, "A1", dedup=False)
+    assert status == "queued" and other is not job
+
+    gate.set()
+    assert _wait(lambda: job.state == COMPLETED and other.state == COMPLETED)
+    # 完成后在去重窗口内自动触发仍复用结果，接口提交则重新分析
+    assert q.submit("gas", {"value": 4}, "A1", auto_triggered=True)[0] is other
+    assert q.submit("gas", {"value": 4}, "A1", dedup=False)[1] == "queued"
+    assert q.deduplicated == 3
+
+
+def test_eviction_by_priority():
+    gate, order, runner = _gated_runner()
+    hub = _Hub()
+    q = AgentJobQueue(hub, runner=runner, workers=1, max_depth=2, dedup_window=0)
+    running, _ = q.submit("advance", {}, "L0")
+    assert _wait(lambda: running.started_at is not None)
+    a1, _ = q.submit("advance", {}, "L1")
+    a2, _ = q.submit("advance", {}, "L2")
+
+    # 队列已满：同优先级的新任务被拒绝，更高优先级的任务挤掉队尾最低优先级（最后入队）的任务
+    assert q.submit("vehicle", {}, "L3") == (None, "rejected")
+    gas, status = q.submit("gas", {}, "L4")
+    assert status == "queued"
+    assert a2.state == DROPPED and a1.state == QUEUED
+    assert any(p["job_id"] == a2.id and p["state"] == DROPPED for p in hub.sent)
+    assert q.rejected == 1 and q.dropped == 1
+
+    gate.set()
+    assert _wait(lambda: a1.state == COMPLETED)
+    assert order == ["advance", "gas", "advance"]
+    assert a2.state == DROPPED
+
+
+def test_history_and_remote_lookup():
+    gate, _, runner = _gated_runner()
+    gate.set()
+    q = AgentJobQueue(_Hub(), runner=runner, workers=1, dedup_window=0, history=3)
+    jobs = [q.submit("gas", {}, f"L{i}")[0] for i in range(5)]
+    assert _wait(lambda: all(j.state == COMPLETED for j in jobs))
+    assert q.get(jobs[0].id) is None and q.get(jobs[-1].id) is jobs[-1]
+
+    # 其他 worker 的任务：由送达的 agent-status 消息重建，同样限 history 条
+    for i in range(5):
+        q._on_status("agent", {"job_id": f"r{i}", "state": QUEUED, "risk_type": "gas", "location": "X"})
+    q._on_status("agent", {"job_id": "r4", "state": "running", "node": "perceive", "at": 1.0})
+    q._on_status("agent", {"job_id": "r4", "state": COMPLETED, "risk_level": "high",
+                           "result": {"analysis": "a", "report": "r"}})
+    assert q.lookup("r0") is None
+    record = q.lookup("r4")
+    assert record["state"] == COMPLETED and record["location"] == "X"
+    assert record["progress"] == [{"node": "perceive", "at": 1.0}]
+    assert record["result"]["risk_level"] == "high"
+    assert q.lookup(jobs[-1].id)["result"]["analysis"] == "ok"
+
+
+if __name__ == "__main__":
+    test_dedup()
+    test_eviction_by_priority()
+    test_history_and_remote_lookup()
+    print("PASS")
@@ -0,0 +1,115 @@
+import random
+
+import anomaly
+from anomaly import AnomalyDetector, StreamDetector
+
+# 流式异常检测：NumPy 回填与逐点更新一致、阶跃触发 CUSUM、平稳序列不报警、feed 只处理游标之后的新行
+#   python test_anomaly.py
+
+
+def _detector(window=60):
+    return StreamDetector("s", window, alpha=0.2, z_limit=4, ewma_l=3.5, cusum_k=0.5, cusum_h=8, min_points=20)
+
+
+def _noise(n, seed=1, mean=10.0, sd=1.0):
+    rng = random.Random(seed)
+    return [rng.gauss(mean, sd) for _ in range(n)]
+
+
+def _close(a, b, tol=1e-9):
+    return abs(a - b) <= tol * max(1.0, abs(a), abs(b))
+
+
+def _assert_same(a, b):
+    assert a.count == b.count and list(a._win) == list(b._win), (a.count, b.count)
+    for attr in ("ewma", "mean", "std", "last"):
+        assert _close(getattr(a, attr), getattr(b, attr)), (attr, getattr(a, attr), getattr(b, attr))
+
+
+def _check_backfill_matches_push():
+    values = _noise(150)
+    for head in (0, 30):
+        ref, det = _detector(), _detector()
+        # head>0：回填前已有逐点更新的状态，验证带初值的 EWMA 闭式解
+        for x in values[:head]:
+            ref._push(x)
+            det._push(x)
+        for x in values[head:]:
+            ref._push(x)
+        det.backfill(values[head:])
+        _assert_same(ref, det)
+        # 回填后继续逐点更新，打分结果一致
+        for x in _noise(20, seed=2):
+            assert ref.update(x) == det.update(x)
+
+
+def test_backfill_matches_push():
+    _check_backfill_matches_push()
+
+
+def test_backfill_without_numpy():
+    saved = anomaly.np
+    anomaly.np = None
+    try:
+        _check_backfill_matches_push()
+    finally:
+        anomaly.np = saved
+
+
+def test_step_change_trips_cusum_up():
+    det = _detector()
+    det.backfill(_noise(60))
+    fired = []
+    for i, x in enumerate(_noise(30, seed=3, mean=12.0)):
+        rules, _ = det.update(x)
+        if "cusum_up" in rules:
+            fired.append(i)
+    assert fired and fired[0] < 10, fired
+    # 报警后累积和清零
+    assert det.stats()["cusumPos"] < 8
+
+
+def test_stationary_series_stays_quiet():
+    det = _detector()
+    det.backfill(_noise(60))
+    for x in _noise(500, seed=4):
+        rules, _ = det.update(x)
+        assert not rules, (x, rules)
+
+
+def test_feed_processes_only_new_rows():
+    det = AnomalyDetector()
+    name = "gas_concentration"
+    stream = det._detectors[name]
+    rows = [{"ts": f"2026-01-01T00:{i // 60:02d}:{i % 60:02d}", "value": 0.1} for i in range(100)]
+
+    # 首次加载：除最后一点外批量回填，只对最新一点打分
+    assert det.feed(name, rows[:50]) == []
+    assert stream.count == 50 and det._cursor[name] == rows[49]["ts"]
+    # 缓冲区与上次重叠：只处理游标之后的行，空值跳过
+    rows[55]["value"] = None
+    assert det.feed(name, rows[:50]) == []
+    assert stream.count == 50
+    det.feed(name, rows[10:60])
+    assert stream.count == 59 and det._cursor[name] == rows[59]["ts"]
+
+    # 新行中的突变被逐点打分
+    spike = {"ts": "2026-01-01T00:01:00.5", "value": 5.0}
+    alerts = det.feed(name, rows[:60] + [spike])
+    assert len(alerts) == 1 and alerts[0]["ts"] == spike["ts"] and "zscore" in alerts[0]["rules"]
+    assert det.alerts == 1
+
+    # 落后超过一个窗口：回填后只打分最新一点
+    later = [{"ts": f"2026-01-02T00:{i // 60:02d}:{i % 60:02d}", "value": 0.1} for i in range(stream.window + 10)]
+    count = stream.count
+    det.feed(name, later)
+    assert stream.count == count + len(later)
+
+
+if __name__ == "__main__":
+    test_backfill_matches_push()
+    test_backfill_without_numpy()
+    test_step_change_trips_cusum_up()
+    test_stationary_series_stays_quiet()
+    test_feed_processes_only_new_rows()
+    print("PASS")
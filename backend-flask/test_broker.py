@@ -0,0 +1,54 @@
+import os
+import time
+import tempfile
+
+from sse import SseHub
+from broker import UnixSocketBroker
+
+# 两个 UnixSocketBroker（模拟两个 worker）：同一条广播在 leader 与 follower 上的事件 ID 必须一致
+#   python test_broker.py
+
+
+def _wait(cond, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if cond():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def _ids(q, n):
+    out = []
+    while len(out) < n:
+        item = q.get(timeout=2)
+        if item is None:
+            break
+        out.append(item.id)
+    return out
+
+
+def test_event_ids_match_across_workers():
+    base = os.path.join(tempfile.mkdtemp(), "sse")
+    leader = SseHub(broker=UnixSocketBroker(base + ".sock", base + ".lock"), idle_timeout=0, max_lag=0)
+    assert _wait(lambda: leader.broker.is_leader)
+    # follower 晚于 leader 创建，其时间戳起点比 leader 的计数器大，不能覆盖 leader 分配的 ID
+    time.sleep(0.05)
+    follower = SseHub(broker=UnixSocketBroker(base + ".sock", base + ".lock"), idle_timeout=0, max_lag=0)
+    assert _wait(lambda: follower.broker.role == "follower")
+
+    q1 = leader.subscribe("t")
+    q2 = follower.subscribe("t")
+    leader.broadcast("t", "risk", {"n": 1})
+    follower.broadcast("t", "risk", {"n": 2})
+    leader.broadcast("t", "risk", {"n": 3})
+
+    ids1, ids2 = _ids(q1, 3), _ids(q2, 3)
+    assert len(ids1) == 3 and ids1 == ids2, (ids1, ids2)
+    assert ids1 == sorted(ids1)
+    print("event ids", ids1, ids2)
+
+
+if __name__ == "__main__":
+    test_event_ids_match_across_workers()
+    print("PASS")
@@ -0,0 +1,77 @@
+import time
+from types import SimpleNamespace
+
+import cache
+from circuit import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from supabase_client import SupabaseClient
+
+# 熔断器状态机，以及熔断打开时客户端快速失败并返回 last-known-good 数据
+#   python test_circuit.py
+
+
+def test_opens_after_threshold_and_probes():
+    b = CircuitBreaker("t", failure_threshold=3, reset_timeout=0.1, half_open_max=1)
+    for _ in range(2):
+        assert b.allow()
+        b.record_failure()
+    assert b.state == CLOSED
+    b.record_failure()
+    assert b.state == OPEN and not b.allow()
+    assert b.rejected == 1 and b.opened == 1
+
+    time.sleep(0.12)
+    assert b.state == HALF_OPEN
+    # 半开状态只放行 half_open_max 个探测请求
+    assert b.allow() and not b.allow()
+    b.record_failure()
+    assert b.state == OPEN and b.opened == 2
+
+    time.sleep(0.12)
+    assert b.allow()
+    b.record_success()
+    assert b.state == CLOSED and b.stats()["failures"] == 0
+
+
+def test_success_resets_failure_count():
+    b = CircuitBreaker("t", failure_threshold=2, reset_timeout=10)
+    b.record_failure()
+    b.record_success()
+    b.record_failure()
+    assert b.state == CLOSED
+
+
+class _Session:
+    def __init__(self):
+        self.calls = 0
+        self.status = 200
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(status_code=self.status, content=b"[1]", text="[1]", headers={},
+                               json=lambda: [{"ts": "t1", "value": 1}])
+
+
+def test_client_fails_fast_and_serves_last_known_good():
+    cache.clear()
+    client = SupabaseClient(f"http://circuit-{time.time()}.test", "key")
+    client.breaker = CircuitBreaker(client.host, failure_threshold=2, reset_timeout=60)
+    client.session = session = _Session()
+    assert client.get_list("t", limit=1, ttl=0.01) == [{"ts": "t1", "value": 1}]
+
+    time.sleep(0.02)
+    session.status = 503
+    for _ in range(2):
+        assert client.get_list("t", limit=1, ttl=0.01) == [{"ts": "t1", "value": 1}]
+    assert client.breaker.state == OPEN
+    # 熔断打开后不再访问上游，直接返回最近一次成功的数据
+    calls = session.calls
+    assert client.get_list("t", limit=1, ttl=0.01) == [{"ts": "t1", "value": 1}]
+    assert session.calls == calls
+    assert client.breaker.rejected == 1
+
+
+if __name__ == "__main__":
+    test_opens_after_threshold_and_probes()
+    test_success_resets_failure_count()
+    test_client_fails_fast_and_serves_last_known_good()
+    print("PASS")
@@ -16,6 +16,8 @@ def run():
     print("safety.settlement", r6.status_code, len(r6.get_data()))
     r7 = c.get("/api/video/list")
     print("video.list", r7.status_code, len(r7.get_data()))
+    r8 = c.get("/api/metrics")
+    print("metrics", r8.status_code, len(r8.get_data()))
 
 if __name__ == "__main__":
     run()
@@ -0,0 +1,151 @@
+import os
+import time
+import threading
+from collections import deque
+
+# 时序表增量同步：每张表一个定长环形缓冲区，只拉取 ts 大于游标的新行
+# 同一时间戳在游标之后才写入的行会被跳过（时序表按 ts 追加写入，可接受）
+
+
+class _Series:
+    __slots__ = ("rows", "cursor", "lock", "guard", "synced_at", "loaded", "appended",
+                 "base_count", "since_seed", "seeded_at")
+
+    def __init__(self, capacity: int):
+        self.rows = deque(maxlen=capacity)
+        self.cursor = None
+        # lock 串行化同一张表的同步（含网络请求）；guard 只保护 rows 的读写
+        self.lock = threading.Lock()
+        self.guard = threading.Lock()
+        self.synced_at = 0.0
+        self.loaded = False
+        self.appended = 0
+        # 本地计数：base_count 为游标处的服务端计数，since_seed 为之后增量追加的行数
+        self.base_count = 0
+        self.since_seed = 0
+        self.seeded_at = 0.0
+
+
+class TimeSeriesSync:
+    def __init__(self, client, capacity: int = None, interval: float = None, select: str = "*"):
+        self.client = client
+        self.capacity = capacity or int(os.getenv("TS_SYNC_CAPACITY", "300"))
+        self.interval = float(os.getenv("TS_SYNC_INTERVAL", "2")) if interval is None else interval
+        self.select = select
+        self.reseed_interval = float(os.getenv("TS_COUNT_RESEED", "600"))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _get(self, table: str) -> _Series:
+        with self._lock:
+            s = self._series.get(table)
+            if s is None:
+                s = self._series[table] = _Series(self.capacity)
+            return s
+
+    def _load(self, table: str, s: _Series) -> int:
+        rows = self.client.get_list(table, select=self.select, order="ts.desc", limit=self.capacity, cache=False)
+        if not rows:
+            return 0
+        with s.guard:
+            s.rows.clear()
+            s.rows.extend(reversed(rows))
+        s.cursor = rows[0].get("ts")
+        return len(rows)
+
+    def _due(self, s: _Series, interval: float) -> bool:
+        return not s.loaded or time.time() - s.synced_at >= interval
+
+    def sync(self, table: str, interval: float = None) -> int:
+        """拉取游标之后的新行追加到缓冲区，返回新增行数。间隔内或他人正在同步时直接返回 0。"""
+        interval = self.interval if interval is None else interval
+        s = self._get(table)
+        if not self._due(s, interval):
+            return 0
+        # 已加载的表不阻塞等待其他线程的同步，直接用缓冲区里的数据
+        if not s.lock.acquire(blocking=not s.loaded):
+            return 0
+        try:
+            if not self._due(s, interval):
+                return 0
+            if s.cursor is None:
+                added = self._load(table, s)
+            else:
+                rows = self.client.get_list(
+                    table, select=self.select, order="ts.asc", limit=self.capacity,
+                    filters={"ts": f"gt.{s.cursor}"}, cache=False
+                )
+                if len(rows) >= self.capacity:
+                    # 落后超过一整个缓冲区，直接重新加载最近窗口；新增行数未知，本地计数需重新校准
+                    added = self._load(table, s)
+                    s.seeded_at = 0.0
+                else:
+                    with s.guard:
+                        s.rows.extend(rows)
+                    if rows:
+                        s.cursor = rows[-1].get("ts") or s.cursor
+                    added = len(rows)
+                    s.since_seed += added
+            s.appended += added
+            s.synced_at = time.time()
+            s.loaded = True
+            return added
+        finally:
+            s.lock.release()
+
+    def series(self, table: str, limit: int = None, ttl: float = None):
+        """返回按 ts 升序的最近 limit 行；ttl 覆盖本次调用的最小同步间隔。"""
+        self.sync(table, interval=ttl)
+        return self._rows(table, limit)
+
+    def _rows(self, table: str, limit: int = None):
+        s = self._get(table)
+        with s.guard:
+            rows = list(s.rows)
+        if limit is not None and len(rows) > limit:
+            rows = rows[-limit:]
+        return rows
+
+    def series_many(self, tables, limit: int = None, ttl: float = None):
+        """并发同步多张表（复用客户端的 fan-out 线程池），按顺序返回各表行列表。"""
+        self.client.run_concurrently([lambda t=t: self.sync(t, interval=ttl) for t in tables])
+        # 直接读缓冲区：fan-out 超时时冷表的同步仍持有锁，不能再阻塞等待它
+        return [self._rows(t, limit) for t in tables]
+
+    def latest(self, table: str, ttl: float = None):
+        rows = self.series(table, limit=1, ttl=ttl)
+        return rows[-1] if rows else None
+
+    def count(self, table: str, ttl: float = None, mode: str = "exact") -> int:
+        """
+        本地维护的行数：以游标处的一次服务端计数为基准（按 mode 计数，限定 ts<=游标），
+        之后累加增量同步追加的行数；每 TS_COUNT_RESEED 秒或缓冲区重载后重新校准。
+        """
+        self.sync(table, interval=ttl)
+        s = self._get(table)
+        if s.cursor is None:
+            return self.client.count(table, ttl=ttl, mode=mode)
+        if s.seeded_at and time.time() - s.seeded_at < self.reseed_interval:
+            return s.base_count + s.since_seed
+        with s.lock:
+            if not s.seeded_at or time.time() - s.seeded_at >= self.reseed_interval:
+                base = self.client.count(table, mode=mode, filters={"ts": f"lte.{s.cursor}"}, strict=True)
+                if base is None:
+                    # 计数请求失败：不记录新基准，下次调用重试；已有基准时继续累加，否则退回不带游标的计数
+                    if s.seeded_at:
+                        return s.base_count + s.since_seed
+                    return self.client.count(table, ttl=ttl, mode=mode)
+                with s.guard:
+                    s.base_count = max(base, len(s.rows))
+                s.since_seed = 0
+                s.seeded_at = time.time()
+            return s.base_count + s.since_seed
+
+    def stats(self):
+        with self._lock:
+            items = list(self._series.items())
+        return {
+            t: {"size": len(s.rows), "cursor": s.cursor, "appended": s.appended, "synced_at": s.synced_at,
+                "count": s.base_count + s.since_seed if s.seeded_at else None}
+            for t, s in items
+        }
@@ -4,15 +4,32 @@ export function connectSSE(url: string, handlers: SSEHandlers) {
   let es: EventSource | null = null;
   let retry = 1000;
   let closed = false;
+  // 手动重连不会自动携带 Last-Event-ID，改用查询参数让服务端补发断线期间的事件
+  let lastEventId = '';
+  const latest: Record<string, any> = {};
 
   const open = () => {
-    es = new EventSource(url);
-    console.info('[sse] open', url);
+    const target = lastEventId
+      ? `${url}${url.includes('?') ? '&' : '?'}lastEventId=${encodeURIComponent(lastEventId)}`
+      : url;
+    es = new EventSource(target);
+    console.info('[sse] open', target);
     es.addEventListener('message', (e: MessageEvent) => {
+      if (e.lastEventId) lastEventId = e.lastEventId;
       try {
         const evt = JSON.parse(e.data);
         const fn = handlers[evt.channel];
-        if (fn) fn(evt.payload);
+        if (!fn) return;
+        // 对象通道可能只推送变化字段（delta），合并到该通道最近一次的完整值上；尚无完整值时等待关键帧
+        if (evt.delta) {
+          const base = latest[evt.channel];
+          if (!base) return;
+          evt.payload = { ...base, ...evt.payload };
+        }
+        if (evt.payload && typeof evt.payload === 'object' && !Array.isArray(evt.payload)) {
+          latest[evt.channel] = evt.payload;
+        }
+        fn(evt.payload);
       } catch {}
     });
     es.addEventListener('heartbeat', () => {});